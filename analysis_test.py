@@ -0,0 +1,126 @@
+import functools
+import sys
+import types
+
+import numpy as np
+import pytest
+
+for module in ('kiwipiepy', 'bertopic', 'torch', 'pytorch_lightning', 'transformers', 'torchvision', 'fairseq'):
+    pytest.importorskip(module)
+
+
+class FakeTable:
+    def __init__(self, inserts, name):
+        self.inserts = inserts
+        self.name = name
+        self.rows = None
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    def execute(self):
+        self.inserts.append((self.name, self.rows))
+        return types.SimpleNamespace(json=lambda: '{"data": [{"id": 1}]}')
+
+
+@pytest.fixture
+def analysis(monkeypatch):
+    # the supabase client is created when api.endpoint.data is imported, the job only needs its tables
+    inserts = []
+    data = types.ModuleType('api.endpoint.data')
+    data.supabase = types.SimpleNamespace(table=lambda name: FakeTable(inserts, name))
+    monkeypatch.setitem(sys.modules, 'api.endpoint.data', data)
+    monkeypatch.delitem(sys.modules, 'service.analysis', raising=False)
+    import service.analysis as analysis
+    analysis.inserts = inserts
+    yield analysis
+    sys.modules.pop('service.analysis', None)
+
+
+def baseline_tagging(original_doc, pros_rep_token, cons_topics, cons_rep_token):
+    # the row by row loops the token index replaced
+    for topic_idx in range(len(pros_rep_token)):
+        for tokens in pros_rep_token[topic_idx]:
+            for i in range(len(original_doc)):
+                if original_doc[i]['tokens'] == tokens:
+                    original_doc[i]['representative_topic'] = topic_idx + 1
+    if len(cons_topics) > 0:
+        for topic_idx in range(len(cons_rep_token)):
+            for tokens in cons_rep_token[topic_idx]:
+                for i in range(len(original_doc)):
+                    if original_doc[i]['tokens'] == tokens:
+                        original_doc[i]['representative_topic'] = -(topic_idx + 1)
+    return original_doc
+
+
+def tag(analysis, original_doc, pros_rep_token, cons_topics, cons_rep_token):
+    rows_by_tokens = analysis._rows_by_tokens(original_doc)
+    analysis._tag_representative_docs(original_doc, rows_by_tokens, pros_rep_token, 1)
+    if len(cons_topics) > 0:
+        analysis._tag_representative_docs(original_doc, rows_by_tokens, cons_rep_token, -1)
+    return original_doc
+
+
+def make_docs(tokens):
+    return [{'document': '리뷰 {}'.format(i), 'tokens': t, 'representative_topic': None} for i, t in enumerate(tokens)]
+
+
+@pytest.mark.parametrize('cons_topics', [[['느리다']], []])
+def test_tag_representative_docs(analysis, cons_topics):
+    tokens = ['배송 빠르다', '맛 좋다', '배송 빠르다', '포장 별로', '맛 좋다', '가격 싸다', '배송 빠르다']
+    pros_rep_token = [['배송 빠르다', '없는 토큰'], ['맛 좋다'], ['배송 빠르다']]
+    cons_rep_token = [['포장 별로'], ['맛 좋다']]
+    tagged = tag(analysis, make_docs(tokens), pros_rep_token, cons_topics, cons_rep_token)
+    assert tagged == baseline_tagging(make_docs(tokens), pros_rep_token, cons_topics, cons_rep_token)
+
+    topics = [doc['representative_topic'] for doc in tagged]
+    # every row with the tokens is tagged, a later topic overwrites an earlier one
+    assert topics[0] == topics[2] == topics[6] == 3
+    if cons_topics:
+        # cons are tagged after pros and overwrite them
+        assert topics[1] == topics[4] == -2
+        assert topics[3] == -1
+    else:
+        assert topics[1] == topics[4] == 2
+        assert topics[3] is None
+    assert topics[5] is None
+
+
+def test_tag_representative_docs_random(analysis):
+    rng = np.random.default_rng(0)
+    vocabulary = ['토큰{}'.format(i) for i in range(30)]
+    tokens = [' '.join(rng.choice(vocabulary, 2)) for _ in range(300)]
+    pros_rep_token = [list(rng.choice(tokens, 3)) for _ in range(4)]
+    cons_rep_token = [list(rng.choice(tokens, 3)) for _ in range(4)]
+    assert (tag(analysis, make_docs(tokens), pros_rep_token, [['x']], cons_rep_token) ==
+            baseline_tagging(make_docs(tokens), pros_rep_token, [['x']], cons_rep_token))
+
+
+def test_sequential_stages_follow_status(analysis, monkeypatch):
+    import service.topic_stages as topic_stages
+    events = []
+    corpus = types.SimpleNamespace(embed=lambda model, batch_size: events.append('embed'))
+    monkeypatch.setattr(topic_stages.FeatureExtraction, 'load_corpus', lambda self, path: corpus)
+    monkeypatch.setattr(topic_stages.FeatureExtraction, 'get_embedding_model', staticmethod(lambda: None))
+
+    def run_stage(corpus, csv_path, product_name, stage):
+        events.append(stage)
+        if stage == 'dtm':
+            docs = [dict(doc, topic=0, month='2023. 1.', star_rating=5) for doc in make_docs(['배송 빠르다', '포장 별로'])]
+            return ['리뷰 0'], docs, [{'topic': 0, 'Timestamp': '2023. 1.', 'words': '배송'}]
+        if stage == 'cons':
+            return [['포장', '별로']], [['포장 별로']]
+        return [['배송', '빠르다']], [['배송 빠르다']]
+    monkeypatch.setattr(topic_stages, 'run_stage', run_stage)
+    monkeypatch.setattr(analysis, 'TopicStages', functools.partial(topic_stages.TopicStages, workers=0))
+    monkeypatch.setattr(analysis, 'get_crawl_data', lambda url, filename: events.append('crawl') or 'reviews.parquet')
+    monkeypatch.setattr(analysis, 'change_user_status', lambda project, status: events.append(status))
+    monkeypatch.setattr(analysis, 'delete_status', lambda project: events.append('done'))
+    monkeypatch.setattr(analysis, 'predict_trend', lambda *args: (np.zeros(157), np.zeros(52), '2020-01-01', '2023-01-01'))
+
+    analysis.crawl_analysis_background('url', 'reviews.csv', 'project', '닭가슴살', '닭고기')
+    # the baseline order: pros and cons, status 3, then the DTM model
+    assert events == [1, 'crawl', 2, 'embed', 'pros', 'cons', 3, 'dtm', 4, 'done']
+    originaldoc = dict(analysis.inserts)['originaldoc']
+    assert [doc['representative_topic'] for doc in originaldoc] == [1, -1]
@@ -1,10 +1,16 @@
+import os
 from fastapi import APIRouter
 from fastapi.responses import FileResponse
+from service.review_store import review_file, export_csv
 
 router = APIRouter()
 
 @router.get("/downloadcsv")
 def download_csv(filename: str):
-    if filename[:7] != 'reviews' or filename[-3:] != 'csv':
+    if filename[:7] != 'reviews' or filename[-3:] != 'csv' or '/' in filename:
         return None;
-    return FileResponse(path='csv/'+filename, filename=filename)
\ No newline at end of file
+    path = 'csv/' + filename
+    # reviews are stored as parquet, the csv is made on the first download
+    if not os.path.exists(path) and os.path.exists(review_file(path)):
+        export_csv(review_file(path), path)
+    return FileResponse(path=path, filename=filename)
\ No newline at end of file
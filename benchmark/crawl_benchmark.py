@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import math
+import time
+
+from benchmark.fake_naver_server import FakeNaverServer, REVIEW_API_PATHS
+from service.crawl import crawl_review_pages, crawl_review_pages_async, REVIEW_PAGE_SIZE
+from service.header_info import review_headers
+from service.http_client import http_client
+
+
+def _run(mode, api_url, concurrency):
+    json_data = {
+        'checkoutMerchantNo': 1,
+        'originProductNo': 1,
+        'page': 1,
+        'pageSize': REVIEW_PAGE_SIZE,
+        'reviewSearchSortType': 'REVIEW_CREATE_DATE_DESC',
+    }
+    reviews = []
+
+    def on_page(page, review_json):
+        reviews.extend(review_json['contents'])
+        return True
+
+    start = time.perf_counter()
+    if mode == 'sequential':
+        pages = crawl_review_pages(api_url, review_headers.copy(), json_data, on_page)
+    else:
+        pages = asyncio.run(crawl_review_pages_async(api_url, review_headers.copy(), json_data, on_page, concurrency))
+    elapsed = time.perf_counter() - start
+    return pages, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sequential vs concurrent review crawl against a local fake review API')
+    parser.add_argument('--reviews', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the fake API sleeps per page')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--rate', type=float, default=10000, help='client rate limit in requests/sec')
+    args = parser.parse_args()
+
+    with FakeNaverServer(total_reviews=args.reviews, latency=args.latency) as server:
+        api_url = server.base_url + REVIEW_API_PATHS[0]
+        http_client.set_rate_limit(server.base_url.split('://')[1], args.rate)
+        expected = min(math.ceil(args.reviews / REVIEW_PAGE_SIZE), 1000)
+        print('reviews: {}, pages: {}, latency: {}s'.format(args.reviews, expected, args.latency))
+
+        runs = [('sequential', 1)] + [('concurrent', c) for c in args.concurrency]
+        for mode, concurrency in runs:
+            http_client.reset_stats()
+            pages, elapsed = _run(mode, api_url, concurrency)
+            print('{:<11} concurrency={:<3} pages={:<5} {:8.2f}s {:8.1f} pages/sec  {}'.format(
+                mode, concurrency, pages, elapsed, pages / elapsed, http_client.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from service.model_registry import model_registry, embedding_model_name, encode_length_bucketed
+from service.review_store import read_reviews
+
+
+WORDS = ['닭가슴살', '배송', '맛있어요', '부드럽고', '양도', '많고', '가격', '저렴해서', '재구매', '합니다',
+         '포장', '꼼꼼', '냄새', '조금', '퍽퍽해요', '다이어트', '식단', '추천', '해동', '간편']
+
+
+def make_reviews(n, seed=0):
+    # review lengths are skewed like real ones, mostly short with a long tail
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(min(200, int(rng.expovariate(1 / 12)) + 2))) for _ in range(n)]
+
+
+def measure(func, texts):
+    start = time.perf_counter()
+    vectors = func(texts)
+    return vectors, len(texts) / (time.perf_counter() - start)
+
+
+def cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fp32 vs int8 embedding backend, plain vs length-bucketed batches')
+    parser.add_argument('--reviews', default=None, help='review store (parquet / csv) to sample the texts from')
+    parser.add_argument('--n', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.reviews:
+        texts = read_reviews(args.reviews, columns=['content'])['content'].tolist()
+        texts = random.Random(args.seed).sample(texts, min(args.n, len(texts)))
+    else:
+        texts = make_reviews(args.n, args.seed)
+    print('{} texts, {:.0f} chars avg'.format(len(texts), sum(map(len, texts)) / len(texts)))
+
+    results = {}
+    for backend in ('fp32', 'int8'):
+        model = model_registry.get(embedding_model_name(backend))
+        cases = [('plain', lambda t: model.encode(t, batch_size=args.batch_size, convert_to_numpy=True)),
+                 ('bucketed', lambda t: encode_length_bucketed(model, t, batch_size=args.batch_size))]
+        for name, func in cases:
+            func(texts[:args.batch_size])
+            results[backend, name], docs_per_sec = measure(func, texts)
+            print('{:<5} {:<9} {:8.1f} docs/s'.format(backend, name, docs_per_sec))
+    print('load', model_registry.stats())
+
+    agreement = cosine(results['fp32', 'plain'], results['int8', 'bucketed'])
+    print('int8 vs fp32 cosine  mean {:.4f}  min {:.4f}  p01 {:.4f}'.format(
+        agreement.mean(), agreement.min(), np.percentile(agreement, 1)))
+    bucketed = cosine(results['fp32', 'plain'], results['fp32', 'bucketed'])
+    print('fp32 bucketed vs plain cosine  min {:.6f}'.format(bucketed.min()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmark.fake_naver_server import FakeNaverServer
+from service.crawl import check_url, get_crawl_data, get_product_basic_info, get_search_volume
+from service.http_client import http_client
+from service.product_meta import product_meta_service
+from service.review_store import read_reviews
+from service.trend_cache import trend_cache
+
+
+SCENARIOS = {
+    'clean': {},
+    'flaky': {'error_rate': 0.1},
+    'rate-limited': {'rate_limit': 30, 'retry_after': '0.2'},
+}
+
+
+def _timed(name, func, *args, **kwargs):
+    http_client.reset_stats()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print('  {:<28} {:8.3f}s  {}'.format(name, elapsed, http_client.stats()))
+    return result, elapsed
+
+
+def run_scenario(name, options, args):
+    print('[{}] {}'.format(name, options or 'no failures'))
+    with FakeNaverServer(total_reviews=args.reviews, latency=args.latency, **options) as server:
+        server.install(http_client)
+        try:
+            url = server.product_url()
+            product_meta_service.invalidate()
+            trend_cache.clear()
+
+            _timed('check_url', check_url, url)
+            _timed('get_product_basic_info', get_product_basic_info, url)
+
+            for concurrency in [1] + args.concurrency:
+                # every run starts from an empty store and checkpoint
+                product_url = server.product_url(product_no=1000 + concurrency)
+                path, elapsed = _timed('get_crawl_data c={}'.format(concurrency), get_crawl_data, product_url,
+                                       'csv/reviews_bench_{}.csv'.format(concurrency), concurrency=concurrency)
+                rows = len(read_reviews(path, columns=['review_id']))
+                print('  {:<28} {} reviews, {:.1f} pages/sec'.format('', rows, rows / 20 / elapsed))
+
+            _timed('get_search_volume (cold)', get_search_volume, '닭가슴살 스테이크', url)
+            _timed('get_search_volume (cached)', get_search_volume, '닭가슴살 스테이크', url)
+            print('  server', server.stats)
+        finally:
+            server.uninstall(http_client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run the crawl entry points against a local fake Naver server')
+    parser.add_argument('--reviews', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[8])
+    parser.add_argument('--client-rate', type=float, default=100, help='client requests/sec per host')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), nargs='*', default=sorted(SCENARIOS))
+    args = parser.parse_args()
+
+    for host in ('smartstore.naver.com', 'brand.naver.com', 'datalab.naver.com'):
+        http_client.set_rate_limit(host, args.client_rate)
+    http_client.backoff_base = 0.05
+
+    # stores, checkpoints and the trend cache are written relative to the working directory,
+    # every scenario starts from an empty one
+    cwd = os.getcwd()
+    for name in args.scenario:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            os.makedirs('csv')
+            try:
+                run_scenario(name, SCENARIOS[name], args)
+            finally:
+                os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
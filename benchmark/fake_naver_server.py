@@ -0,0 +1,273 @@
+import datetime
+import hashlib
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from service.page_json import PRELOADED_STATE_MARKER
+
+
+REVIEW_API_PATHS = ['/i/v1/contents/reviews/query-pages', '/n/v1/contents/reviews/query-pages']
+PRODUCT_PATH_RE = re.compile(r'^/[^/]+/products/(\d+)$')
+# product pages with this product number have no product state, like a removed product
+MISSING_PRODUCT_NO = 404
+
+DEFAULT_CONFIG = {
+    'total_reviews': 2000,
+    'latency': 0.05,         # seconds per request
+    'error_rate': 0.0,       # share of requests answered with 500
+    'rate_limit': None,      # requests/sec before answering 429
+    'retry_after': '1',      # Retry-After header of 429 answers
+    'empty_keywords': (),    # keywords datalab has no data for
+    'seed': 0,
+}
+
+
+def make_review(review_id: int):
+    # review ids grow with time, so the newest review has id == total_reviews
+    created = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(hours=7 * review_id)
+    return {
+        'id': review_id,
+        'writerId': 'user{}'.format(review_id),
+        'reviewContent': '배송 빠르고 좋아요, 맛도 괜찮고 재구매 의사 있습니다 {}'.format(review_id),
+        'reviewScore': random.Random(review_id).randint(1, 5),
+        'createDate': created.strftime('%Y-%m-%dT%H:%M:%S.000+00:00'),
+    }
+
+
+def make_product_page(product_no: int, total_reviews: int):
+    state = {'product': {'A': {
+        'channel': {'naverPaySellerNo': 510000000 + product_no % 1000},
+        'productNo': product_no,
+        'name': '닭가슴살 스테이크 {}'.format(product_no),
+        'category': {'category1Id': '50000006', 'category2Id': '50000145', 'category3Id': '50000920',
+                     'wholeCategoryName': '식품>축산물>닭고기'},
+        'reviewAmount': {'totalReviewCount': total_reviews},
+        'naverShoppingSearchInfo': {'brandName': '테스트브랜드', 'modelName': None},
+        'seoInfo': {'sellerTags': [{'text': '닭가슴살'}, {'text': '다이어트'}, {'text': '단백질'}]},
+        'productImages': [{'url': 'https://shop-phinf.pstatic.net/{}.jpg'.format(product_no)}],
+        'detailContents': ['<p>상세 설명 {}</p>'.format(i) for i in range(300)],
+    }}}
+    filler = ''.join('<div class="item"><span>상품 {}</span></div>'.format(i) for i in range(500))
+    return '<!DOCTYPE html><html><head><title>상품</title></head><body><script>{}{}</script>{}</body></html>'.format(
+        PRELOADED_STATE_MARKER, json.dumps(state, ensure_ascii=False), filler)
+
+
+def make_trend_data(keyword: str, start_date: str, end_date: str):
+    # weekly periods (mondays) from the first day of start_date's month to the end of end_date's month
+    start = datetime.date(int(start_date[:4]), int(start_date[4:6]), 1)
+    end_year, end_month = int(end_date[:4]), int(end_date[4:6])
+    end = datetime.date(end_year + end_month // 12, end_month % 12 + 1, 1) - datetime.timedelta(days=1)
+    day = start + datetime.timedelta(days=(7 - start.weekday()) % 7)
+    phase = int(hashlib.md5(keyword.encode('utf-8')).hexdigest()[:4], 16) % 52
+    data = []
+    while day <= end:
+        week = len(data)
+        value = 50 + 40 * math.sin(2 * math.pi * (week + phase) / 52)
+        data.append({'period': day.strftime('%Y%m%d'), 'value': round(value, 5)})
+        day += datetime.timedelta(days=7)
+    return data
+
+
+class FakeNaverHandler(BaseHTTPRequestHandler):
+    # keep-alive, otherwise every request pays a new connection
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # headers and body go out in separate writes, don't let Nagle hold the body back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str, content_type='application/json;charset=UTF-8', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _admit(self, kind):
+        """Applies latency, rate limit and error injection, returns False if the request was answered."""
+        server = self.server
+        config = server.config
+        server.count(kind)
+        time.sleep(config['latency'])
+        if not server.take_token():
+            server.count('throttled')
+            self._send(429, '{"message": "Too Many Requests"}', headers={'Retry-After': config['retry_after']})
+            return False
+        if config['error_rate'] and server.random() < config['error_rate']:
+            server.count('errors')
+            self._send(500, '{"message": "Internal Server Error"}')
+            return False
+        return True
+
+    def do_GET(self):
+        config = self.server.config
+        parts = urlsplit(self.path)
+        match = PRODUCT_PATH_RE.match(parts.path)
+        if match:
+            if not self._admit('product_page'):
+                return
+            product_no = int(match.group(1))
+            if product_no == MISSING_PRODUCT_NO:
+                self._send(200, '<html><body><div>삭제된 상품입니다.</div></body></html>', 'text/html;charset=UTF-8')
+                return
+            self._send(200, make_product_page(product_no, config['total_reviews']), 'text/html;charset=UTF-8')
+            return
+
+        if parts.path == '/keyword/trendResult.naver':
+            if not self._admit('trend'):
+                return
+            hash_key = parse_qs(parts.query).get('hashKey', [''])[0]
+            keyword, start_date, end_date = self.server.hashes.get(hash_key, ('', '202001', '202001'))
+            data = [] if keyword in config['empty_keywords'] else make_trend_data(keyword, start_date, end_date)
+            graph_data = json.dumps([{'title': keyword, 'keyword': [keyword], 'data': data}], ensure_ascii=False)
+            page = '<html><body><div class="graph_area"></div><div id="graph_data" style="display:none">{}</div></body></html>'.format(graph_data)
+            self._send(200, page, 'text/html;charset=UTF-8')
+            return
+        self._send(404, '{}')
+
+    def do_POST(self):
+        config = self.server.config
+        path = urlsplit(self.path).path
+        body = self._read_body()
+        if path in REVIEW_API_PATHS:
+            if not self._admit('review_page'):
+                return
+            body = json.loads(body or b'{}')
+            page = int(body.get('page', 1))
+            page_size = int(body.get('pageSize', 20))
+            total = config['total_reviews']
+            start = (page - 1) * page_size
+            if start >= total:
+                # the real API answers a page past the end with a bare "OK"
+                self._send(200, 'OK', 'text/plain')
+                return
+            # newest first, like reviewSearchSortType=REVIEW_CREATE_DATE_DESC
+            contents = [make_review(total - start - i) for i in range(min(page_size, total - start))]
+            self._send(200, json.dumps({'contents': contents, 'totalElements': total, 'page': page}))
+            return
+
+        if path == '/qcHash.naver':
+            if not self._admit('hash'):
+                return
+            form = parse_qs(body.decode('utf-8'))
+            keyword = form.get('queryGroups', [''])[0].split('__SZLIG__')[0]
+            window = (keyword, form.get('startDate', [''])[0], form.get('endDate', [''])[0])
+            hash_key = hashlib.md5('|'.join(window).encode('utf-8')).hexdigest()
+            self.server.hashes[hash_key] = window
+            self._send(200, json.dumps({'hashKey': hash_key}))
+            return
+        self._send(404, '{}')
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the socketserver default of 5 overflows at high crawl concurrency and connects wait on SYN retries
+    request_queue_size = 128
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeNaverHandler)
+        self.config = config
+        self.hashes = {}
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(config['seed'])
+        self._tokens = None
+        self._updated = time.monotonic()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def take_token(self):
+        rate = self.config['rate_limit']
+        if not rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is None:
+                self._tokens = rate
+            self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class FakeNaverServer:
+    """Local stand-in for the smartstore/brand product pages, the review query-pages API and the
+    datalab qcHash/trendResult pages. See DEFAULT_CONFIG for what can be tuned.
+
+    ``install(http_client)`` points the crawler's http client at it, so the real crawl functions
+    can run unchanged.
+    """
+    origins = ['https://smartstore.naver.com', 'https://brand.naver.com', 'https://datalab.naver.com']
+
+    def __init__(self, host='127.0.0.1', port=0, **config):
+        unknown = set(config) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise TypeError('unknown fake server options: {}'.format(sorted(unknown)))
+        self.httpd = _FakeHTTPServer((host, port), dict(DEFAULT_CONFIG, **config))
+        self.thread = None
+
+    @property
+    def config(self):
+        return self.httpd.config
+
+    @property
+    def stats(self):
+        return self.httpd.stats
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def product_url(self, product_no=7290642963, store='breastdak', brand=False):
+        origin = self.origins[1 if brand else 0]
+        return '{}/{}/products/{}'.format(origin, store, product_no)
+
+    def install(self, http_client):
+        for origin in self.origins:
+            http_client.host_overrides[origin] = self.base_url
+
+    def uninstall(self, http_client):
+        for origin in self.origins:
+            http_client.host_overrides.pop(origin, None)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,73 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from service.forecast import GTM_CHECKPOINT, GTM_CONFIG, ForecastEngine, build_gtm
+from service.GTM import GTM
+
+
+def per_call_forecast(checkpoint, text, trends):
+    # what predict_trend did on every call: build the model, load the checkpoint, run it eagerly
+    model = GTM(**GTM_CONFIG)
+    model.load_state_dict(torch.load(checkpoint, map_location=torch.device('cpu'))['state_dict'], strict=False)
+    model.eval()
+    forecast, _ = model(torch.FloatTensor(text).reshape(1, -1), torch.FloatTensor(np.array([trends])))
+    return forecast.detach().cpu().numpy().flatten()[:GTM_CONFIG['output_dim']]
+
+
+def measure(func, inputs, repeat):
+    func(*inputs[0])
+    times = []
+    for _ in range(repeat):
+        for args in inputs:
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, np.percentile(times, 95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='per-call GTM loading vs the cached, traced forecast engine')
+    parser.add_argument('--checkpoint', default=GTM_CHECKPOINT)
+    parser.add_argument('--inputs', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    checkpoint = args.checkpoint
+    if not os.path.exists(checkpoint):
+        # the timings don't depend on the weights
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'gtm-random.ckpt')
+        torch.manual_seed(0)
+        torch.save({'state_dict': GTM(**GTM_CONFIG).state_dict()}, checkpoint)
+        print('{} not found, using random weights'.format(args.checkpoint))
+
+    rng = np.random.default_rng(0)
+    inputs = [(rng.standard_normal(768).astype(np.float32),
+               rng.random((GTM_CONFIG['num_trends'], GTM_CONFIG['trend_len'])).astype(np.float32))
+              for _ in range(args.inputs)]
+
+    start = time.perf_counter()
+    engine = ForecastEngine(build_gtm(checkpoint))
+    print('engine load + trace {:8.1f} ms'.format((time.perf_counter() - start) * 1000))
+
+    eager = ForecastEngine(build_gtm(checkpoint), trace=False)
+    diff = max(np.abs(per_call_forecast(checkpoint, *x) - engine.predict(*x)).max() for x in inputs)
+    cases = [('per call', lambda text, trends: per_call_forecast(checkpoint, text, trends)),
+             ('eager', eager.predict),
+             ('traced', engine.predict)]
+    for name, func in cases:
+        median, p95 = measure(func, inputs, args.repeat)
+        print('{:<9} {:8.2f} ms/forecast (p95 {:.2f})'.format(name, median, p95))
+    print('max abs difference per call vs traced {:.2e}'.format(diff))
+
+
+if __name__ == '__main__':
+    main()
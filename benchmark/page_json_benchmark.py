@@ -0,0 +1,100 @@
+import argparse
+import glob
+import json
+import os
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup as bs
+
+from service.page_json import extract_product_json, extract_graph_data, PRELOADED_STATE_MARKER
+
+
+def make_product_page(n_filler=3000):
+    state = {'product': {'A': {
+        'channel': {'naverPaySellerNo': 510000000},
+        'productNo': 7290642963,
+        'name': '닭가슴살 스테이크 100g',
+        'category': {'category1Id': '50000006', 'category2Id': '50000145', 'wholeCategoryName': '식품>축산물>닭고기'},
+        'reviewAmount': {'totalReviewCount': 12345},
+        'naverShoppingSearchInfo': {'brandName': '브랜드', 'modelName': None},
+        'seoInfo': {'sellerTags': [{'text': '태그{}'.format(i)} for i in range(20)]},
+        'productImages': [{'url': 'https://shop-phinf.pstatic.net/{}.jpg'.format(i)} for i in range(10)],
+        'detailContents': ['<p>상세 설명 {}</p>'.format(i) for i in range(1500)],
+    }}}
+    filler = ''.join('<div class="item"><span>상품 {}</span><a href="/p/{}">링크</a></div>'.format(i, i) for i in range(n_filler))
+    return '<!DOCTYPE html><html><head><title>상품</title></head><body><script>{}{}</script>{}</body></html>'.format(
+        PRELOADED_STATE_MARKER, json.dumps(state, ensure_ascii=False), filler)
+
+
+def make_trend_page(n_filler=3000):
+    data = [{'title': '닭가슴살', 'keyword': ['닭가슴살'],
+             'data': [{'period': '2021{:04d}'.format(i), 'value': i % 100} for i in range(157)]}]
+    filler = ''.join('<li class="row"><em>{}</em></li>'.format(i) for i in range(n_filler))
+    return '<html><body><div class="wrap">{}</div><div id="graph_data" style="display:none">{}</div></body></html>'.format(
+        filler, json.dumps(data, ensure_ascii=False))
+
+
+def bs_product_json(html):
+    soup = bs(html, 'html.parser')
+    return json.loads(soup.select_one('body > script').get_text()[27:])
+
+
+def bs_graph_data(html):
+    soup = bs(html, 'html.parser')
+    return json.loads(soup.select_one('#graph_data').get_text()[1:-1])
+
+
+def measure(func, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            func(page)
+    per_lookup = (time.perf_counter() - start) / (repeat * len(pages))
+
+    tracemalloc.start()
+    for page in pages:
+        func(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_lookup, peak
+
+
+def load_pages(directory, pattern):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append(f.read())
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bs4 vs targeted scan for product / trend page json')
+    parser.add_argument('--pages', default=None, help='directory with saved product_*.html and trend_*.html pages')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    product_pages, trend_pages = [], []
+    if args.pages:
+        product_pages = load_pages(args.pages, 'product_*.html')
+        trend_pages = load_pages(args.pages, 'trend_*.html')
+    if not product_pages:
+        product_pages = [make_product_page()]
+    if not trend_pages:
+        trend_pages = [make_trend_page()]
+
+    cases = [('product json', product_pages, bs_product_json, extract_product_json),
+             ('graph data', trend_pages, bs_graph_data, extract_graph_data)]
+    for name, pages, slow, fast in cases:
+        assert all(slow(page) == fast(page) for page in pages)
+        size = sum(len(page) for page in pages) / len(pages) / 1024
+        slow_time, slow_peak = measure(slow, pages, args.repeat)
+        fast_time, fast_peak = measure(fast, pages, args.repeat)
+        print('{:<13} {} pages, {:.0f}KB avg'.format(name, len(pages), size))
+        print('  bs4   {:8.2f} ms/lookup  peak {:8.1f} KB'.format(slow_time * 1000, slow_peak / 1024))
+        print('  scan  {:8.2f} ms/lookup  peak {:8.1f} KB  ({:.0f}x faster)'.format(
+            fast_time * 1000, fast_peak / 1024, slow_time / fast_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import hashlib
+import time
+
+import numpy as np
+from bertopic.backend import BaseEmbedder
+from sklearn.feature_extraction.text import CountVectorizer
+
+from service.feature_extraction import build_topic_model, FAST_PCA_COMPONENTS
+from service.term_matrix import TermMatrixBuilder, TermMatrixVectorizer
+from service.text_preprocessing import SimpleTokenizerForBERTopic
+
+
+SYLLABLES = ['가', '나', '맛', '배', '송', '포', '장', '가', '격', '닭', '살', '양', '냄', '새', '식', '단', '추', '천', '해', '동']
+
+
+class HashEmbedder(BaseEmbedder):
+    """A fixed random vector per token, a text is the mean of its tokens. Stands in for the sentence model
+    so documents and the words KeyBERTInspired embeds live in the same space without loading it."""
+    def __init__(self, dim=768):
+        super().__init__()
+        self.dim = dim
+        self._vectors = {}
+
+    def _vector(self, token):
+        if token not in self._vectors:
+            seed = int(hashlib.md5(token.encode('utf-8')).hexdigest()[:8], 16)
+            self._vectors[token] = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return self._vectors[token]
+
+    def embed(self, documents, verbose=False):
+        vectors = np.zeros((len(documents), self.dim), dtype=np.float32)
+        for i, document in enumerate(documents):
+            tokens = document.split()
+            if tokens:
+                vectors[i] = np.mean([self._vector(t) for t in tokens], axis=0)
+        return vectors
+
+
+def make_corpus(n, n_latent=8, words_per_topic=40, seed=0):
+    # tokenized reviews, each drawn mostly from one latent topic's words with some shared words
+    rng = np.random.default_rng(seed)
+    vocab = list(dict.fromkeys(''.join(rng.choice(SYLLABLES, 3)) for _ in range(20 * n_latent * words_per_topic)))
+    shared = vocab[:words_per_topic]
+    topic_words = [vocab[words_per_topic * (k + 1):words_per_topic * (k + 2)] for k in range(n_latent)]
+    weights = 1 / np.arange(1, words_per_topic + 1)
+    weights /= weights.sum()
+    documents = []
+    for topic in rng.integers(0, n_latent, n):
+        length = int(rng.integers(3, 20))
+        own = rng.choice(topic_words[topic], length, p=weights)
+        noise = rng.choice(shared, max(1, length // 4))
+        documents.append(' '.join(np.concatenate([own, noise])))
+    return documents
+
+
+def npmi_coherence(topics, documents):
+    """Mean NPMI of the top word pairs of each topic over document co-occurrence."""
+    vectorizer = CountVectorizer(tokenizer=SimpleTokenizerForBERTopic(), token_pattern=None, binary=True, lowercase=False)
+    X = vectorizer.fit_transform(documents).tocsc()
+    column = vectorizer.vocabulary_
+    n = X.shape[0]
+    scores = []
+    for words in topics:
+        ids = [column[w] for w in words if w in column]
+        if len(ids) < 2:
+            continue
+        sub = X[:, ids]
+        joint = (sub.T @ sub).toarray() / n
+        p = np.diag(joint)
+        pairs = []
+        for i in range(len(ids)):
+            for j in range(i + 1, len(ids)):
+                if joint[i, j] == 0:
+                    pairs.append(-1.0)
+                elif joint[i, j] == 1:
+                    pairs.append(1.0)
+                else:
+                    pairs.append(np.log(joint[i, j] / (p[i] * p[j])) / -np.log(joint[i, j]))
+        scores.append(np.mean(pairs))
+    return float(np.mean(scores)) if scores else float('nan')
+
+
+def fit(mode, documents, embeddings, embedder, n_topic):
+    terms = TermMatrixBuilder()
+    terms.add([document.split() for document in documents])
+    vectorizer = TermMatrixVectorizer(*terms.build(), documents)
+    model = build_topic_model(embedder, vectorizer, n_topic=n_topic, mode=mode, n_documents=len(documents))
+    start = time.perf_counter()
+    topics, _ = model.fit_transform(documents, embeddings=embeddings)
+    seconds = time.perf_counter() - start
+    keywords = [[w for w, _ in model.get_topic(i)[:10]] for i in range(n_topic - 1) if model.get_topic(i)]
+    outliers = float(np.mean(np.array(topics) == -1))
+    return seconds, keywords, outliers
+
+
+def main():
+    parser = argparse.ArgumentParser(description='default (UMAP + HDBSCAN) vs fast (PCA + mini-batch k-means) topic models')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--modes', nargs='+', default=['default', 'fast'])
+    parser.add_argument('--n-topic', type=int, default=5)
+    parser.add_argument('--dim', type=int, default=768)
+    args = parser.parse_args()
+
+    embedder = HashEmbedder(args.dim)
+    print('fast mode: PCA {} components'.format(FAST_PCA_COMPONENTS))
+    # UMAP and HDBSCAN compile with numba on first use, keep that out of the timings
+    warmup = make_corpus(500, seed=1)
+    for mode in args.modes:
+        fit(mode, warmup, embedder.embed(warmup), embedder, args.n_topic)
+    for n in args.sizes:
+        documents = make_corpus(n)
+        embeddings = embedder.embed(documents)
+        for mode in args.modes:
+            seconds, keywords, outliers = fit(mode, documents, embeddings, embedder, args.n_topic)
+            print('{:>6} docs  {:<8} {:8.1f} s  {} topics  outliers {:5.1%}  npmi {:.3f}'.format(
+                n, mode, seconds, len(keywords), outliers, npmi_coherence(keywords, documents)))
+
+
+if __name__ == '__main__':
+    main()
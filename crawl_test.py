@@ -1,3 +1,162 @@
-from service.crawl import check_url, make_date_li, get_search_volume
+import json
 
-# def test_check_url():
+import pytest
+import requests
+
+from benchmark.fake_naver_server import FakeNaverServer, MISSING_PRODUCT_NO
+from service import crawl
+from service.crawl import check_url, make_date_li, get_search_volume, get_crawl_data, get_product_basic_info
+from service.http_client import http_client
+from service.page_json import PRELOADED_STATE_MARKER
+from service.product_meta import parse_product_meta, product_meta_service
+from service.review_store import read_reviews
+from service.trend_cache import trend_cache
+
+
+@pytest.fixture
+def fake_naver(tmp_path, monkeypatch):
+    # checkpoints, stores and the trend cache are written relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'csv').mkdir()
+    monkeypatch.setattr(http_client, 'backoff_base', 0.01)
+    for host in ('smartstore.naver.com', 'brand.naver.com', 'datalab.naver.com'):
+        http_client.set_rate_limit(host, 1000)
+    servers = []
+
+    def start(**config):
+        server = FakeNaverServer(**dict({'total_reviews': 100, 'latency': 0}, **config)).start()
+        server.install(http_client)
+        servers.append(server)
+        product_meta_service.invalidate()
+        trend_cache.clear()
+        return server
+
+    yield start
+    for server in servers:
+        server.uninstall(http_client)
+        server.stop()
+    product_meta_service.invalidate()
+
+
+def test_check_url(fake_naver):
+    server = fake_naver()
+    assert check_url(server.product_url())
+    assert check_url(server.product_url(brand=True))
+    assert not check_url(server.product_url(product_no=MISSING_PRODUCT_NO))
+    assert not check_url('https://www.coupang.com/vp/products/123')
+
+
+def test_get_product_basic_info(fake_naver):
+    server = fake_naver(total_reviews=321)
+    info = get_product_basic_info(server.product_url(product_no=1234))
+    assert info['review_cnt'] == 321
+    assert info['product_name'] == '닭가슴살 스테이크 1234'
+    # the page is fetched once, the second call is served from the product cache
+    get_product_basic_info(server.product_url(product_no=1234))
+    assert server.stats['product_page'] == 1
+
+
+def test_parse_product_meta_null_fields():
+    # optional objects the page sets to null are treated like missing ones
+    product = {'channel': {'naverPaySellerNo': 510000001}, 'productNo': 1, 'name': '닭가슴살',
+               'category': None, 'naverShoppingSearchInfo': None, 'reviewAmount': None, 'seoInfo': None,
+               'productImages': None}
+    html = '<script>{}{}</script>'.format(PRELOADED_STATE_MARKER, json.dumps({'product': {'A': product}}))
+    meta = parse_product_meta('https://smartstore.naver.com/store/products/1', 0, html)
+    assert (meta.merchant_no, meta.product_no, meta.review_cnt) == (510000001, 1, 0)
+    assert meta.category_id is None and meta.brand_name is None and meta.word_list == []
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_get_crawl_data(fake_naver, concurrency):
+    server = fake_naver(total_reviews=250)
+    path = get_crawl_data(server.product_url(), 'csv/reviews_test.csv', concurrency=concurrency)
+    df = read_reviews(path)
+    assert len(df) == 250
+    assert df['review_id'].tolist() == list(range(250, 0, -1))
+
+
+def _interrupt_at(monkeypatch, stop_page):
+    # the crawl fails when it gets to stop_page, like a dropped connection
+    write_page = crawl._CheckpointedPageWriter.__call__
+
+    def on_page(self, page, review_json):
+        if page == stop_page:
+            raise ConnectionError('interrupted on page {}'.format(page))
+        return write_page(self, page, review_json)
+    monkeypatch.setattr(crawl._CheckpointedPageWriter, '__call__', on_page)
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_get_crawl_data_resumes(fake_naver, monkeypatch, concurrency):
+    server = fake_naver(total_reviews=1000)
+    with monkeypatch.context() as m:
+        _interrupt_at(m, 21)
+        path = get_crawl_data(server.product_url(), 'csv/reviews_test.csv', concurrency=concurrency)
+    assert read_reviews(path, columns=['review_id'])['review_id'].tolist() == list(range(1000, 600, -1))
+
+    requests_before = server.stats['review_page']
+    path = get_crawl_data(server.product_url(), 'csv/reviews_test.csv', concurrency=concurrency)
+    assert read_reviews(path, columns=['review_id'])['review_id'].tolist() == list(range(1000, 0, -1))
+    # only the 30 pages after the interruption are fetched again
+    assert server.stats['review_page'] - requests_before == 30
+
+
+def test_get_crawl_data_refresh(fake_naver):
+    server = fake_naver(total_reviews=1000)
+    get_crawl_data(server.product_url(), 'csv/reviews_test.csv', concurrency=4)
+    server.config['total_reviews'] = 1130
+    product_meta_service.invalidate()
+
+    requests_before = server.stats['review_page']
+    path = get_crawl_data(server.product_url(), 'csv/reviews_test.csv')
+    assert sorted(read_reviews(path, columns=['review_id'])['review_id']) == list(range(1, 1131))
+    # 130 new reviews are on pages 1-7, page 7 reaches the stored ones and stops the refresh
+    assert server.stats['review_page'] - requests_before == 7
+
+    requests_before = server.stats['review_page']
+    path = get_crawl_data(server.product_url(), 'csv/reviews_test.csv', refresh=False)
+    assert len(read_reviews(path, columns=['review_id'])) == 1130
+    assert server.stats['review_page'] == requests_before
+
+
+def test_get_crawl_data_retries_errors(fake_naver):
+    server = fake_naver(total_reviews=400, error_rate=0.2, seed=3)
+    path = get_crawl_data(server.product_url(), 'csv/reviews_test.csv', concurrency=4)
+    assert read_reviews(path, columns=['review_id'])['review_id'].nunique() == 400
+    assert server.stats['errors'] > 0
+
+
+def test_get_crawl_data_rate_limited(fake_naver):
+    server = fake_naver(total_reviews=300, rate_limit=10, retry_after='0.05')
+    # the client allows more than the server, it has to slow down on the 429 answers
+    http_client.set_rate_limit('smartstore.naver.com', 20)
+    path = get_crawl_data(server.product_url(), 'csv/reviews_test.csv', concurrency=8)
+    assert len(read_reviews(path, columns=['review_id'])) == 300
+    assert server.stats['throttled'] > 0
+
+
+def test_get_crawl_data_gives_up(fake_naver, monkeypatch):
+    fake_naver(error_rate=1.0)
+    monkeypatch.setattr(http_client, 'max_retries', 1)
+    with pytest.raises(requests.HTTPError):
+        http_client.post('https://smartstore.naver.com/i/v1/contents/reviews/query-pages', json={'page': 1})
+
+
+def test_get_search_volume(fake_naver):
+    server = fake_naver()
+    date_li = make_date_li()
+    volume, start, end = get_search_volume('닭가슴살', server.product_url())
+    assert len(volume) == 157
+    assert (start, end) == (date_li[0], date_li[-1])
+    assert any(volume)
+    # weekly trend data is cached, asking again doesn't hit datalab
+    trend_requests = server.stats['trend']
+    assert get_search_volume('닭가슴살', server.product_url())[0] == volume
+    assert server.stats['trend'] == trend_requests
+
+
+def test_get_search_volume_no_data(fake_naver):
+    server = fake_naver(empty_keywords=('없는키워드',))
+    volume, _, _ = get_search_volume('없는키워드', server.product_url())
+    assert volume == [0] * 157
@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('kiwipiepy')
+pytest.importorskip('bertopic')
+
+from bertopic import BERTopic
+from bertopic.representation import BaseRepresentation
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import PCA
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+from benchmark.topic_model_benchmark import HashEmbedder, make_corpus
+import service.feature_extraction as feature_extraction
+from service.feature_extraction import FeatureExtraction, TermMatrixBERTopic, nearest_topics, topic_term_counts
+from service.term_matrix import TermMatrixBuilder, TermMatrixVectorizer
+from service.text_preprocessing import SimpleTokenizerForBERTopic, month_index, month_label, parse_times
+from service.tokenized_corpus import TokenizedCorpus
+from util.time_similarity_metric import dynamic_time_warping, minmax_scaler, mse, pearson_corr
+
+
+def term_matrix_vectorizer(documents):
+    terms = TermMatrixBuilder()
+    terms.add([document.split() for document in documents])
+    return TermMatrixVectorizer(*terms.build(), documents)
+
+
+def joined_counts(topic_model, documents, groups):
+    # what BERTopic's _c_tf_idf counts: the joined documents of each group after _preprocess_text
+    joined = pd.DataFrame({'Document': documents, 'Topic': groups}).groupby('Topic').agg({'Document': ' '.join})
+    return topic_model.vectorizer_model.transform(topic_model._preprocess_text(joined.Document.values))
+
+
+def fit(model_class, vectorizer, documents, embedder):
+    model = model_class(embedding_model=embedder, vectorizer_model=vectorizer, top_n_words=30,
+                        umap_model=PCA(n_components=5, random_state=42),
+                        hdbscan_model=MiniBatchKMeans(n_clusters=4, n_init=3, random_state=42))
+    model.fit_transform(documents, embeddings=embedder.embed(documents))
+    return model
+
+
+def test_term_matrix_topics_match_bertopic():
+    documents = make_corpus(400, seed=3)
+    embedder = HashEmbedder(32)
+    expected = fit(BERTopic, CountVectorizer(tokenizer=SimpleTokenizerForBERTopic(), token_pattern=None, max_features=3000),
+                   documents, embedder)
+    model = fit(TermMatrixBERTopic, term_matrix_vectorizer(documents), documents, embedder)
+    assert model.topics_ == expected.topics_
+    assert model.vectorizer_model.get_feature_names_out().tolist() == expected.vectorizer_model.get_feature_names_out().tolist()
+    assert abs(model.c_tf_idf_ - expected.c_tf_idf_).max() < 1e-12
+    assert model.get_topics() == expected.get_topics()
+
+
+@pytest.mark.parametrize('language', [None, 'english'])
+def test_topic_term_counts_preprocessing(language):
+    documents = ['배송 빠르다', '배송\t느리다', '', 'good 맛 좋다', '', '포장 별로', '', 'emptydoc 배송']
+    groups = np.array([0, 0, 1, 2, 3, 3, 4, 4])
+    topic_model = BERTopic(vectorizer_model=term_matrix_vectorizer(documents + ['emptydoc']))
+    topic_model.language = language
+    counts = topic_term_counts(topic_model, documents, groups, 5, topic_model.vectorizer_model.transform(documents))
+    expected = joined_counts(topic_model, documents, groups)
+    assert counts.toarray().tolist() == expected.toarray().tolist()
+    # the group of the one empty document counts as "emptydoc"
+    emptydoc = topic_model.vectorizer_model.vocabulary_['emptydoc']
+    assert counts[1, emptydoc] == 1
+    assert counts.toarray()[[0, 2, 3], emptydoc].tolist() == [0, 0, 0]
+
+
+def test_c_tf_idf_per_month_matches_joined_documents():
+    documents = make_corpus(300, seed=4)
+    embedder = HashEmbedder(32)
+    vectorizer = term_matrix_vectorizer(documents)
+    fe = FeatureExtraction()
+    fe.topic_model = fit(TermMatrixBERTopic, vectorizer, documents, embedder)
+    fe.terms = vectorizer.matrix
+    months = np.random.default_rng(0).integers(24240, 24252, len(documents))
+    frame = pd.DataFrame({'Document': documents, 'Topic': fe.topic_model.topics_, 'Timestamps': months})
+    pairs, frequency, c_tf_idf, words = fe._c_tf_idf_per_month(frame)
+
+    groups = frame.groupby(['Timestamps', 'Topic'], sort=True).ngroup().to_numpy()
+    expected = normalize(fe.topic_model.ctfidf_model.transform(joined_counts(fe.topic_model, documents, groups)), norm='l1')
+    assert abs(c_tf_idf - expected).max() < 1e-12
+    assert frequency.tolist() == np.bincount(groups).tolist()
+    assert list(pairs) == sorted(set(zip(months.tolist(), fe.topic_model.topics_)))
+    assert words.tolist() == vectorizer.words.tolist()
+
+
+def naive_topics_per_month(topic_model, documents, topics, months):
+    # month by month like the loop _c_tf_idf_per_month replaced, months without documents are skipped
+    frame = pd.DataFrame({'Document': documents, 'Topic': topics, 'Timestamps': months})
+    rows, topic_word_per_month = [], {}
+    for month in range(min(months), max(months) + 1):
+        selection = frame[frame.Timestamps == month]
+        if len(selection) == 0:
+            continue
+        documents_per_topic = selection.groupby(['Topic'], as_index=False).agg({'Document': ' '.join, 'Timestamps': 'count'})
+        c_tf_idf, words = topic_model._c_tf_idf(documents_per_topic, fit=False)
+        c_tf_idf = normalize(c_tf_idf, axis=1, norm='l1', copy=False)
+        words_per_topic = topic_model._extract_words_per_topic(words, selection, c_tf_idf, calculate_aspects=False)
+        label = month_label(month)
+        topic_word_per_month[label] = words_per_topic
+        frequency = dict(zip(documents_per_topic.Topic, documents_per_topic.Timestamps))
+        rows.extend((topic, ', '.join([w for w, _ in values][:30]), frequency[topic], label)
+                    for topic, values in words_per_topic.items())
+    return pd.DataFrame(rows, columns=['topic', 'words', 'Frequency', 'Timestamp']), topic_word_per_month
+
+
+def naive_word_series(topic_word_per_month, topic_idx):
+    # the dict of lists the words x months matrix replaced
+    series = {}
+    columns = [words_per_topic[topic_idx] for words_per_topic in topic_word_per_month.values() if topic_idx in words_per_topic]
+    for col, word_scores in enumerate(columns):
+        for w, p in word_scores:
+            series.setdefault(w, [0.0] * len(columns))[col] += p
+    return series
+
+
+def test_topics_per_month_matches_month_loop():
+    documents = make_corpus(400, seed=5)
+    embedder = HashEmbedder(32)
+    vectorizer = term_matrix_vectorizer(documents)
+    fe = FeatureExtraction()
+    fe.topic_model = fit(TermMatrixBERTopic, vectorizer, documents, embedder)
+    fe.n_topic = 5
+    fe.documents = documents
+    fe.terms = vectorizer.matrix
+    # 2021. 1. - 2021. 8., no reviews in 2021. 4.
+    fe.months = np.random.default_rng(1).choice([24252, 24253, 24254, 24256, 24257, 24258, 24259], len(documents))
+
+    dtm = fe.get_topics_per_month()
+    expected_dtm, topic_word_per_month = naive_topics_per_month(fe.topic_model, documents, fe.topic_model.topics_, fe.months.tolist())
+    pd.testing.assert_frame_equal(dtm, expected_dtm)
+    assert '2021. 4.' not in set(dtm.Timestamp)
+    assert list(fe.topic_word_per_month) == list(topic_word_per_month)
+
+    for topic_idx in range(4):
+        words, series = fe.get_word_series(topic_idx)
+        expected = naive_word_series(topic_word_per_month, topic_idx)
+        assert words == list(expected)
+        assert np.allclose(series, np.array([expected[w] for w in words]), rtol=0, atol=1e-12)
+
+        target = minmax_scaler(dtm.loc[dtm.topic == topic_idx, 'Frequency'].values)
+        for metric, score, largest in (('pearson', pearson_corr, True), ('mse', mse, False), ('dtw', dynamic_time_warping, False)):
+            keywords = fe.get_keywords_with_time_series(dtm, topic_idx, metric=metric, top_n_words=5)
+            scores = pd.Series({w: score(np.array(values), target) for w, values in expected.items()})
+            best = scores.dropna().sort_values(ascending=not largest)[:5]
+            assert np.allclose(keywords.values, best.values, rtol=0, atol=1e-9)
+            assert np.allclose(scores[keywords.index].values, keywords.values, rtol=0, atol=1e-9)
+
+
+class CTfIdfWords(BaseRepresentation):
+    # the c-TF-IDF words as they are, KeyBERTInspired would load the embedding model
+    def extract_topics(self, topic_model, documents, c_tf_idf, topics):
+        return topics
+
+
+def clustered_embeddings(n, n_clusters=4, dim=16, seed=0):
+    # tight clusters around random centres, a row's nearest sampled rows are in its own cluster
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_clusters, dim)) * 10
+    return (centres[np.arange(n) % n_clusters] + rng.normal(size=(n, dim)) * 0.1).astype(np.float32)
+
+
+def test_nearest_topics():
+    rng = np.random.default_rng(0)
+    sample = normalize(rng.normal(size=(200, 16)))
+    sample_topics = rng.integers(-1, 4, len(sample))
+    vectors = normalize(rng.normal(size=(50, 16)))
+    nearest = np.argmax(vectors @ sample.T, axis=1)
+    assert nearest_topics(sample, sample_topics, vectors, k=1).tolist() == sample_topics[nearest].tolist()
+
+    # the majority of the k nearest, a tie goes to the lower topic
+    neighbors = np.argsort(-(vectors @ sample.T), axis=1)[:, :5]
+    expected = [min(set(topics), key=lambda t: (-topics.tolist().count(t), t)) for topics in sample_topics[neighbors]]
+    assert nearest_topics(sample, sample_topics, vectors, k=5).tolist() == expected
+
+
+def test_fit_on_sample_assigns_nearest_topics():
+    documents = make_corpus(400, seed=6)
+    embeddings = clustered_embeddings(len(documents))
+    model = TermMatrixBERTopic(embedding_model=HashEmbedder(16), vectorizer_model=term_matrix_vectorizer(documents),
+                               top_n_words=30,
+                               umap_model=PCA(n_components=5, random_state=42),
+                               hdbscan_model=MiniBatchKMeans(n_clusters=4, n_init=3, random_state=42))
+    fit_rows = np.arange(0, len(documents), 3)
+    FeatureExtraction._fit_on_sample(model, documents, embeddings, fit_rows, 'default', batch_size=50)
+
+    topics = np.array(model.topics_)
+    rest = np.setdiff1d(np.arange(len(documents)), fit_rows)
+    nearest = fit_rows[np.argmax(normalize(embeddings[rest]) @ normalize(embeddings[fit_rows]).T, axis=1)]
+    assert topics[rest].tolist() == topics[nearest].tolist()
+    # a cluster is one topic, in the sample and out of it
+    assert all(len(set(topics[np.arange(len(documents)) % 4 == c])) == 1 for c in range(4))
+    assert len(topics) == len(documents)
+    assert sum(model.topic_sizes_.values()) == len(documents)
+
+
+@pytest.mark.parametrize('sample_size, sampled', [(0, False), (60, False), (100, False), (20, True)])
+def test_train_samples_only_larger_corpora(monkeypatch, sample_size, sampled):
+    documents = make_corpus(60, seed=7)
+    times = parse_times(pd.Series(['2023-{:02d}-15T12:00:00.000+09:00'.format(i % 2 + 1) for i in range(len(documents))]))
+    data = pd.DataFrame({'document': documents, 'time': times, 'month': month_index(times),
+                         'content': documents, 'star_rating': [5] * len(documents)})
+    corpus = TokenizedCorpus(data, documents[:10], clustered_embeddings(len(documents)))
+    monkeypatch.setattr(FeatureExtraction, 'load_corpus', lambda self, path: corpus)
+    build_topic_model = feature_extraction.build_topic_model
+    monkeypatch.setattr(feature_extraction, 'build_topic_model', lambda *args, **kwargs: build_topic_model(
+        *args, **dict(kwargs, representation_model=CTfIdfWords())))
+    calls = []
+    fit_on_sample = FeatureExtraction._fit_on_sample
+    monkeypatch.setattr(FeatureExtraction, '_fit_on_sample', staticmethod(
+        lambda model, documents, embeddings, fit_rows, mode: calls.append(len(fit_rows)) or
+        fit_on_sample(model, documents, embeddings, fit_rows, mode)))
+
+    fe = FeatureExtraction()
+    fe.train_topic_model_with_bertopic('reviews.csv', '닭가슴살', mode='fast', sample_size=sample_size)
+    assert bool(calls) == sampled
+    if sampled:
+        assert calls[0] < len(documents)
+    assert len(fe.topic_model.topics_) == len(documents)
+    # words the sample lacks don't break the monthly c-TF-IDF of every document
+    dtm = fe.get_topics_per_month()
+    assert dtm.Frequency.sum() == len(documents)
+    assert all(np.isfinite(score) for words in fe.topic_word_per_month.values()
+               for values in words.values() for _, score in values)
@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
 from api.api import api_router
+from service.model_registry import model_registry
+from service.topic_stages import shutdown_pools
 
 app = FastAPI()
 
@@ -18,3 +20,14 @@ app.add_middleware(
 )
 
 app.include_router(api_router)
+
+
+@app.on_event("startup")
+def preload_models():
+    # PRELOAD_MODELS, so the first analysis doesn't pay the model loading
+    model_registry.preload()
+
+
+@app.on_event("shutdown")
+def stop_topic_workers():
+    shutdown_pools()
@@ -102,13 +102,13 @@ class GTrendEmbedder(nn.Module):
         self.encoder = nn.TransformerEncoder(encoder_layer, num_layers=2)
         self.use_mask = use_mask
         self.gpu_num = gpu_num
+        # the trends are always trend_len weeks long, the mask is built once and moves with the model
+        self.register_buffer('input_mask', self._generate_encoder_mask(trend_len, forecast_horizon), persistent=False)
 
     def _generate_encoder_mask(self, size, forecast_horizon):
-        mask = torch.zeros((size, size))
-        split = math.gcd(size, forecast_horizon)
-        for i in range(0, size, split):
-            mask[i:i + split, i:i + split] = 1
-        mask = mask.float().masked_fill(mask == 0, float('-inf')).masked_fill(mask == 1, float(0.0)).to('cpu')
+        # steps attend within their block of gcd(size, forecast_horizon) steps only
+        block = torch.arange(size) // math.gcd(size, forecast_horizon)
+        mask = torch.zeros((size, size)).masked_fill(block.unsqueeze(1) != block.unsqueeze(0), float('-inf'))
         return mask
 
     def _generate_square_subsequent_mask(self, size):
@@ -119,8 +119,10 @@ class GTrendEmbedder(nn.Module):
     def forward(self, gtrends):
         gtrend_emb = self.input_linear(gtrends.permute(0, 2, 1))
         gtrend_emb = self.pos_embedding(gtrend_emb.permute(1, 0, 2))
-        input_mask = self._generate_encoder_mask(gtrend_emb.shape[0], self.forecast_horizon)
         if self.use_mask == 1:
+            input_mask = self.input_mask
+            if input_mask.shape[0] != gtrend_emb.shape[0]:
+                input_mask = self._generate_encoder_mask(gtrend_emb.shape[0], self.forecast_horizon).to(gtrend_emb.device)
             gtrend_emb = self.encoder(gtrend_emb, input_mask)
         else:
             gtrend_emb = self.encoder(gtrend_emb)
@@ -137,7 +139,9 @@ class TextEmbedder(nn.Module):
         self.gpu_num = gpu_num
 
     def forward(self, text):
-        word_embeddings = torch.Tensor(text).to('cpu')
+        # a tensor is used as is, so a traced graph doesn't record it as a constant
+        word_embeddings = text if isinstance(text, torch.Tensor) else torch.Tensor(text)
+        word_embeddings = word_embeddings.to('cpu')
 
         # Embed to our embedding space
         word_embeddings = self.dropout(self.fc(word_embeddings))
@@ -1,55 +1,60 @@
 from service.crawl import get_crawl_data
 from service.custom_error import NotValidKeywordError, NotEnoughSearchVolumeError
 from util.handle_user import change_user_status, delete_status
-from service.feature_extraction import FeatureExtraction
+from service.topic_stages import TopicStages
 from service.forecast import predict_trend
 import json
+from collections import defaultdict
 from api.endpoint.data import supabase
 
+def _rows_by_tokens(original_doc):
+    # reviews with the same tokens all get tagged, like comparing every row
+    rows_by_tokens = defaultdict(list)
+    for i, doc in enumerate(original_doc):
+        rows_by_tokens[doc['tokens']].append(i)
+    return rows_by_tokens
+
+
+def _tag_representative_docs(original_doc, rows_by_tokens, rep_tokens, sign):
+    # later topics overwrite earlier ones, cons (sign -1) are tagged after pros
+    for topic_idx in range(len(rep_tokens)):
+        for tokens in rep_tokens[topic_idx]:
+            for i in rows_by_tokens.get(tokens, ()):
+                original_doc[i]['representative_topic'] = sign * (topic_idx+1)
+
+
 def crawl_analysis_background(url, filename, project_name, product_name, category):
     
     # revire crawling
     change_user_status(project_name, 1)
     try:
-        res = get_crawl_data(url, filename)
+        review_path = get_crawl_data(url, filename)
     except NotValidKeywordError:
         change_user_status(project_name, 6)
         return
     change_user_status(project_name, 2)
     
-    fe = FeatureExtraction()
-    # pros extraction
-    fe.train_topic_model_with_bertopic(filename, product_name, star_rating_range=[5, 5])
-    pros_topics, pros_rep_token = fe.get_topics_with_keyword(top_n_word=10)
-    
-    # cons extraction
-    try:
-        fe.train_topic_model_with_bertopic(filename, product_name, star_rating_range=[1, 3])
-        cons_topics, cons_rep_token = fe.get_topics_with_keyword(top_n_word=10)
-    except:
-        cons_topics = []
+    # pros, cons and dtm topic models share one tokenized corpus, see TOPIC_WORKERS for running them at once
+    with TopicStages(review_path, product_name) as stages:
+        # pros extraction
+        pros_topics, pros_rep_token = stages.result('pros')
 
-    change_user_status(project_name, 3)
+        # cons extraction
+        try:
+            cons_topics, cons_rep_token = stages.result('cons')
+        except:
+            cons_topics = []
 
+        change_user_status(project_name, 3)
 
-    # dtm
-    review_to_summ, original_doc = fe.train_topic_model_with_bertopic(filename, product_name)
-    dtm_result = fe.get_topics_per_month().to_dict('records')
 
-    for topic_idx in range(len(pros_rep_token)):
-        topic_tokens = pros_rep_token[topic_idx]
-        for tokens in topic_tokens:
-            for i in range(len(original_doc)):
-                if original_doc[i]['tokens'] == tokens:
-                    original_doc[i]['representative_topic'] = topic_idx+1
+        # dtm
+        review_to_summ, original_doc, dtm_result = stages.result('dtm')
 
+    rows_by_tokens = _rows_by_tokens(original_doc)
+    _tag_representative_docs(original_doc, rows_by_tokens, pros_rep_token, 1)
     if len(cons_topics) > 0:
-        for topic_idx in range(len(cons_rep_token)):
-            topic_tokens = cons_rep_token[topic_idx]
-            for tokens in topic_tokens:
-                for i in range(len(original_doc)):
-                    if original_doc[i]['tokens'] == tokens:
-                        original_doc[i]['representative_topic'] = -(topic_idx+1)
+        _tag_representative_docs(original_doc, rows_by_tokens, cons_rep_token, -1)
 
     change_user_status(project_name, 4)
 
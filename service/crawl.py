@@ -1,186 +1,212 @@
-import requests
-from bs4 import BeautifulSoup as bs
 import json
-import csv
 import math
-import pandas as pd
-# from service.custom_error import NotValidKeywordError, NotEnoughSearchVolumeError
+import os
+import asyncio
+import aiohttp
+from service.custom_error import NotValidKeywordError, NotEnoughSearchVolumeError, NotSupportedUrlError
 import datetime
 from dateutil.relativedelta import relativedelta
-from service.header_info import review_cookies, review_headers, trend_cookies, trend_headers
+from service.header_info import review_cookies, trend_cookies, trend_headers, datalab_cookies, datalab_headers
+from service.product_meta import get_product_meta, product_headers
+from service.page_json import extract_graph_data
+from service.crawl_checkpoint import CrawlCheckpoint, CRAWLING, DONE
+from service.review_store import ReviewStore, review_file, review_row
+from service.trend_cache import trend_cache
+from service.http_client import http_client
 
 
 review_api = ['https://smartstore.naver.com/i/v1/contents/reviews/query-pages', 'https://brand.naver.com/n/v1/contents/reviews/query-pages']
-origin_li = ['https://smartstore.naver.com', 'https://brand.naver.com']
+
+REVIEW_PAGE_SIZE = 20
+MAX_REVIEW_PAGE = 1000
+# 1 keeps the original page-by-page crawl, larger values switch to the asyncio crawler
+CRAWL_CONCURRENCY = int(os.environ.get('CRAWL_CONCURRENCY', 1))
+DATE_AXIS_KEYWORD = '닭가슴살'
 
 
 def check_url(url: str):
-    res = requests.get(url, cookies=review_cookies, headers=review_headers)
-    html = res.text
-    soup = bs(html, 'html.parser')
-    json_element = soup.select_one('body > script')
-    if json_element is None:
+    try:
+        get_product_meta(url)
+    except (NotSupportedUrlError, NotValidKeywordError):
         return False
     return True
 
 
-def get_crawl_data(url: str, filename: str):
-    
-    cf = open(filename, 'w', encoding='utf-8', newline='')
-    wr = csv.writer(cf)
-    wr.writerow(['userid', 'content', 'star_rating', 'time'])
-    api_idx = 0
-    
-    headers = review_headers.copy()
-    headers['referer'] = url
-    if url[8:28] == 'smartstore.naver.com':
-        api_idx = 0
-    elif url[8:23] == 'brand.naver.com':
-        api_idx = 1
-    else:
-        return 'fail'
-    
-    headers['origin'] = origin_li[api_idx]
+def get_crawl_data(url: str, filename: str, concurrency: int = None, refresh: bool = True):
+    if concurrency is None:
+        concurrency = CRAWL_CONCURRENCY
 
-    res = requests.get(url, cookies=review_cookies, headers=headers)
-    html = res.text
-    # print(html)
-    soup = bs(html, 'html.parser')
-    json_element = soup.select_one('body > script')
-    if json_element is None:
-        raise NotValidKeywordError('Keyword for get reviews is not valid.');
+    try:
+        meta = get_product_meta(url)
+    except NotSupportedUrlError:
+        return 'fail'
 
-    # merchantNo: categoryTree > product > A > channel > naverPaySellerNo
-    item_json = json.loads(json_element.get_text()[27:])
-    merchantNo = item_json['product']['A']['channel']['naverPaySellerNo']
-    originProductNo = item_json['product']['A']['productNo']
+    api_idx = meta.api_idx
+    headers = product_headers(meta.url, api_idx)
+    merchantNo = meta.merchant_no
+    originProductNo = meta.product_no
 
     print(merchantNo, originProductNo)
     json_data = {
         'checkoutMerchantNo': merchantNo,
         'originProductNo': originProductNo,
         'page': 1,
-        'pageSize': 20,
-        'reviewSearchSortType': 'REVIEW_RANKING',
+        'pageSize': REVIEW_PAGE_SIZE,
+        # newest first, so a refresh can stop at the stored high-water mark
+        'reviewSearchSortType': 'REVIEW_CREATE_DATE_DESC',
     }
 
+    # reviews are kept per product, an interrupted crawl continues from its checkpoint
+    # and a finished one only fetches reviews newer than the last crawl.
+    job_file = review_file(filename)
+    store = ReviewStore(merchantNo, originProductNo)
+    checkpoint = CrawlCheckpoint.load(merchantNo, originProductNo)
+    if checkpoint.status is not None and not store.exists():
+        checkpoint = CrawlCheckpoint(merchantNo, originProductNo)
+    if checkpoint.status == DONE and not refresh:
+        return store.snapshot(job_file)
+    checkpoint.start_pass()
+    start_page = checkpoint.last_page + 1
+    print(checkpoint.status, 'from page', start_page)
+
+    if checkpoint.status == CRAWLING and checkpoint.last_page == 0:
+        store.reset()
+    on_page = _CheckpointedPageWriter(store, checkpoint)
+
     try:
-        i = 1
-        total_review_num = 20
-        while i <= math.ceil(total_review_num / 20):
-            if i > 1000:
-                break
-            json_data['page'] = i
-            res = requests.post(
-                review_api[api_idx],
-                cookies=review_cookies,
-                headers=headers,
-                json=json_data,
-            )
-            # print(res.text)
-            if res.text == 'OK':
-                print('end on', i)
-                break
-            review_json = json.loads(res.text)
-            review_cont = review_json['contents']
-            total_review_num = int(review_json['totalElements'])
-            i += 1
-            for item in review_cont:
-                userid = item['writerId']
-                cont = item['reviewContent']
-                review_time = item['createDate']
-                cont = cont.replace('\n', ' ').replace(',', ' ')
-                sr = item['reviewScore']
-                wr.writerow([userid, cont, sr, review_time])
+        if concurrency > 1 and checkpoint.status == CRAWLING:
+            asyncio.run(crawl_review_pages_async(review_api[api_idx], headers, json_data, on_page, concurrency, start_page))
+        else:
+            crawl_review_pages(review_api[api_idx], headers, json_data, on_page, start_page)
+        on_page.commit()
+        checkpoint.finish_pass()
     except Exception as e:
         print(e)
+        # buffered rows are whole pages, keep them with the matching checkpoint
+        on_page.commit()
 
-    cf.close()
-    return filename
+    print('http', http_client.stats())
+    return store.snapshot(job_file)
 
 
-def get_product_basic_info(url):
-    headers = review_headers.copy()
-    headers['referer'] = url
-    if url[8:28] == 'smartstore.naver.com':
-        api_idx = 0
-    elif url[8:23] == 'brand.naver.com':
-        api_idx = 1
-    else:
-        raise Exception
-    
-    headers['origin'] = origin_li[api_idx]
-
-    res = requests.get(url, cookies=review_cookies, headers=headers)
-    html = res.text
-
-    soup = bs(html, 'html.parser')
-    json_element = soup.select_one('body > script')
-    if json_element is None:
-        raise NotValidKeywordError('Keyword for get reviews is not valid.');
-
-    # merchantNo: categoryTree > product > A > channel > naverPaySellerNo
-    item_json = json.loads(json_element.get_text()[27:])
-    product_name = item_json["product"]["A"]["name"]
-    category_list = item_json["product"]["A"]["category"]["wholeCategoryName"].split('>')
-    review_cnt = item_json["product"]["A"]["reviewAmount"]["totalReviewCount"]
-    brand_name = item_json["product"]["A"]["naverShoppingSearchInfo"]["brandName"]
-    try:
-        model_name = item_json["product"]["A"]["naverShoppingSearchInfo"]["modelName"]
-    except:
-        model_name = None
-    word_list = [item['text'] for item in item_json["product"]["A"]["seoInfo"]["sellerTags"]]
-    img_url = item_json["product"]["A"]["productImages"][0]["url"]
-    return {'product_name': product_name, 
-            'category_list': category_list, 
-            'review_cnt': review_cnt,
-            'brand_name': brand_name,
-            'model_name': model_name,
-            'word_list': word_list,
-            'img_url': img_url}
+class _CheckpointedPageWriter:
+    def __init__(self, store, checkpoint):
+        self.store = store
+        self.checkpoint = checkpoint
 
+    def __call__(self, page, review_json):
+        keep_going = True
+        rows = []
+        for item in review_json['contents']:
+            if self.checkpoint.is_old(item):
+                keep_going = False
+                break
+            if self.checkpoint.is_written(item):
+                continue
+            rows.append(review_row(item))
+            self.checkpoint.mark_written(item)
+        self.checkpoint.last_page = page
+        # the checkpoint is saved only when the buffered rows reach the disk
+        if self.store.append(rows):
+            self.checkpoint.save()
+        return keep_going
+
+    def commit(self):
+        self.store.flush()
+        self.checkpoint.save()
+
+
+def crawl_review_pages(api_url: str, headers: dict, json_data: dict, on_page, start_page: int = 1):
+    # fetch review pages one by one, total_review_num is refreshed from every response.
+    # on_page(page, review_json) handles a page and returns False to stop the crawl.
+    i = start_page
+    total_review_num = start_page * REVIEW_PAGE_SIZE
+    while i <= math.ceil(total_review_num / REVIEW_PAGE_SIZE):
+        if i > MAX_REVIEW_PAGE:
+            break
+        json_data['page'] = i
+        res = http_client.post(
+            api_url,
+            cookies=review_cookies,
+            headers=headers,
+            json=json_data,
+        )
+        # print(res.text)
+        if res.text == 'OK':
+            print('end on', i)
+            break
+        review_json = json.loads(res.text)
+        total_review_num = int(review_json['totalElements'])
+        i += 1
+        if not on_page(i - 1, review_json):
+            break
+    return i - 1
+
+
+async def _fetch_review_page(session, semaphore, api_url, headers, json_data, page):
+    payload = dict(json_data, page=page)
+    async with semaphore:
+        status, text = await http_client.async_request(session, 'POST', api_url, cookies=review_cookies,
+                                                       headers=headers, json=payload)
+    if text == 'OK':
+        return None
+    return json.loads(text)
+
+
+async def crawl_review_pages_async(api_url: str, headers: dict, json_data: dict, on_page, concurrency: int,
+                                   start_page: int = 1):
+    # the first page tells how many reviews there are, the remaining pages are then requested
+    # concurrently over one keep-alive session and handed to on_page in page order.
+    if start_page > MAX_REVIEW_PAGE:
+        return start_page - 1
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        review_json = await _fetch_review_page(session, semaphore, api_url, headers, json_data, start_page)
+        if review_json is None:
+            print('end on', start_page)
+            return start_page - 1
+        if not on_page(start_page, review_json):
+            return start_page
+
+        total_review_num = int(review_json['totalElements'])
+        last_page = min(math.ceil(total_review_num / REVIEW_PAGE_SIZE), MAX_REVIEW_PAGE)
+        pages = range(start_page + 1, last_page + 1)
+        tasks = [asyncio.ensure_future(_fetch_review_page(session, semaphore, api_url, headers, json_data, page))
+                 for page in pages]
+        handled = start_page
+        try:
+            for page, task in zip(pages, tasks):
+                review_json = await task
+                if review_json is None:
+                    print('end on', page)
+                    break
+                handled = page
+                if not on_page(page, review_json):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return handled
 
 
-def make_date_li():
-    hash_key = _get_search_volume_hash('닭가슴살')
-
-    headers = {
-        'authority': 'datalab.naver.com',
-        'accept': '*/*',
-        'accept-language': 'ko-KR,ko;q=0.9',
-        'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-        # 'cookie': 'NNB=WNMPDB3YQHDWK; _datalab_cid=50000000',
-        'origin': 'https://datalab.naver.com',
-        'referer': 'https://datalab.naver.com/keyword/trendResult.naver',
-        'sec-ch-ua': '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
-        'sec-fetch-dest': 'empty',
-        'sec-fetch-mode': 'cors',
-        'sec-fetch-site': 'same-origin',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-        'x-requested-with': 'XMLHttpRequest',
-    }
+def get_product_basic_info(url):
+    return get_product_meta(url).basic_info()
 
-    cookies = {
-        'NNB': '55CLS2SUU3DWK',
-        '_datalab_cid': '50000000',
-    }
 
-    params = {
-        'hashKey': hash_key
-    }
 
-    res = requests.get('https://datalab.naver.com/keyword/trendResult.naver', params=params, cookies=cookies, headers=headers)
-    # print(res.text)
-    soup = bs(res.text, 'html.parser')
-    data = soup.select_one('#graph_data').get_text()
-    data_json = json.loads(data[1:-1])
-    data_json = data_json['data']
-    if len(data_json) == 0:
+def make_date_li():
+    # weekly date axis of the last 3 years, taken from a keyword that has data every week
+    date_li = trend_cache.get_or_fetch('date_axis', DATE_AXIS_KEYWORD, _search_volume_window(), _fetch_date_li)
+    if len(date_li) == 0:
         print('no record')
         return 'no record'
+    return date_li
+
 
+def _fetch_date_li():
+    data_json = _get_trend_data(DATE_AXIS_KEYWORD)
     if len(data_json) > 157:
         data_json = data_json[-157:]
     return [item['period'] for item in data_json]
@@ -193,38 +219,28 @@ def _get_category_id(url: str):
     # category_id_list = json.loads(requests.get('https://api.itemscout.io/api/v2/keyword/products?kid={}&type=total'.format(keyword_id)).text)['data']['productListResult']
     # if len(category_id_list) == 0:
     #     raise NotValidKeywordError()
-    headers = review_headers.copy()
-    headers['referer'] = url
-    if url[8:28] == 'smartstore.naver.com':
-        api_idx = 0
-    elif url[8:23] == 'brand.naver.com':
-        api_idx = 1
-    else:
+    try:
+        meta = get_product_meta(url)
+    except NotSupportedUrlError:
         return 'fail'
-    
-    headers['origin'] = origin_li[api_idx]
-
-    res = requests.get(url, cookies=review_cookies, headers=headers)
-    html = res.text
-    # print(html)
-    soup = bs(html, 'html.parser')
-    json_element = soup.select_one('body > script')
-    if json_element is None:
-        raise NotValidKeywordError('Keyword for get reviews is not valid.');
 
-    # merchantNo: categoryTree > product > A > channel > naverPaySellerNo
-    item_json = json.loads(json_element.get_text()[27:])
-    category_id = item_json["product"]["A"]["category"]["category1Id"]
+    return meta.category_id
 
-    return category_id
 
-
-def _get_search_volume_hash(keyword):
+def _search_volume_window():
     end_date = datetime.datetime.now() - relativedelta(month=1)
     start_date = end_date - relativedelta(years=3)
     end_date_str = end_date.strftime('%Y%m')
     start_date_str = start_date.strftime('%Y%m')
+    return start_date_str, end_date_str
+
+
+def _get_search_volume_hash(keyword):
+    window = _search_volume_window()
+    return trend_cache.get_or_fetch('hash', keyword, window, lambda: _fetch_search_volume_hash(keyword, *window))
 
+
+def _fetch_search_volume_hash(keyword, start_date_str, end_date_str):
     # cookies = search_hash_cookies.copy()
     # cookies['_datalab_cid'] = str(category_id)
 
@@ -238,30 +254,7 @@ def _get_search_volume_hash(keyword):
         'device': '',
     }
 
-    headers = {
-        'authority': 'datalab.naver.com',
-        'accept': '*/*',
-        'accept-language': 'ko-KR,ko;q=0.9',
-        'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-        # 'cookie': 'NNB=WNMPDB3YQHDWK; _datalab_cid=50000000',
-        'origin': 'https://datalab.naver.com',
-        'referer': 'https://datalab.naver.com/keyword/trendResult.naver',
-        'sec-ch-ua': '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
-        'sec-fetch-dest': 'empty',
-        'sec-fetch-mode': 'cors',
-        'sec-fetch-site': 'same-origin',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-        'x-requested-with': 'XMLHttpRequest',
-    }
-
-    cookies = {
-        'NNB': '55CLS2SUU3DWK',
-        '_datalab_cid': '50000000',
-    }
-
-    response = requests.post('https://datalab.naver.com/qcHash.naver', cookies=cookies, headers=headers, data=data)
+    response = http_client.post('https://datalab.naver.com/qcHash.naver', cookies=datalab_cookies, headers=datalab_headers, data=data)
 
     res_json = json.loads(response.text)
     hash_key = res_json['hashKey']
@@ -269,45 +262,27 @@ def _get_search_volume_hash(keyword):
     return hash_key
 
 
-def get_search_volume(keyword: str, url: str):
-    hash_key = _get_search_volume_hash(keyword)
-    print(hash_key)
-
-    date_li = make_date_li()
+def _get_trend_data(keyword):
+    return trend_cache.get_or_fetch('trend', keyword, _search_volume_window(), lambda: _fetch_trend_data(keyword))
 
-    headers = {
-        'authority': 'datalab.naver.com',
-        'accept': '*/*',
-        'accept-language': 'ko-KR,ko;q=0.9',
-        'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-        # 'cookie': 'NNB=WNMPDB3YQHDWK; _datalab_cid=50000000',
-        'origin': 'https://datalab.naver.com',
-        'referer': 'https://datalab.naver.com/keyword/trendResult.naver',
-        'sec-ch-ua': '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
-        'sec-fetch-dest': 'empty',
-        'sec-fetch-mode': 'cors',
-        'sec-fetch-site': 'same-origin',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-        'x-requested-with': 'XMLHttpRequest',
-    }
 
-    cookies = {
-        'NNB': '55CLS2SUU3DWK',
-        '_datalab_cid': '50000000',
-    }
+def _fetch_trend_data(keyword):
+    hash_key = _get_search_volume_hash(keyword)
+    print(hash_key)
 
     params = {
         'hashKey': hash_key
     }
 
-    res = requests.get('https://datalab.naver.com/keyword/trendResult.naver', params=params, cookies=cookies, headers=headers)
+    res = http_client.get('https://datalab.naver.com/keyword/trendResult.naver', params=params, cookies=datalab_cookies, headers=datalab_headers)
     # print(res.text)
-    soup = bs(res.text, 'html.parser')
-    data = soup.select_one('#graph_data').get_text()
-    data_json = json.loads(data[1:-1])
-    data_json = data_json['data']
+    data_json = extract_graph_data(res.text)
+    return data_json['data']
+
+
+def get_search_volume(keyword: str, url: str):
+    date_li = make_date_li()
+    data_json = _get_trend_data(keyword)
     
     if len(data_json) > 157:
         data_json = data_json[-157:]
@@ -347,29 +322,11 @@ def get_click_volume(keyword: str, url: str):
     # category_id_list = json.loads(requests.get('https://api.itemscout.io/api/v2/keyword/products?kid={}&type=total'.format(keyword_id)).text)['data']['productListResult']
     # if len(category_id_list) == 0:
     #     raise NotValidKeywordError()
-    headers = review_headers.copy()
-    headers['referer'] = url
-    if url[8:28] == 'smartstore.naver.com':
-        api_idx = 0
-    elif url[8:23] == 'brand.naver.com':
-        api_idx = 1
-    else:
+    try:
+        category_id = get_product_meta(url).category_id
+    except NotSupportedUrlError:
         return 'fail'
     
-    headers['origin'] = origin_li[api_idx]
-
-    res = requests.get(url, cookies=review_cookies, headers=headers)
-    html = res.text
-    # print(html)
-    soup = bs(html, 'html.parser')
-    json_element = soup.select_one('body > script')
-    if json_element is None:
-        raise NotValidKeywordError('Keyword for get reviews is not valid.');
-
-    # merchantNo: categoryTree > product > A > channel > naverPaySellerNo
-    item_json = json.loads(json_element.get_text()[27:])
-    category_id = item_json["product"]["A"]["category"]["category1Id"]
-    
     # category_id = category_id_list[0]['categoryStack'][0]
     print(category_id)
     data = {
@@ -383,7 +340,7 @@ def get_click_volume(keyword: str, url: str):
         'keyword': keyword,
     }
 
-    res = requests.post(
+    res = http_client.post(
         'https://datalab.naver.com/shoppingInsight/getKeywordClickTrend.naver',
         cookies=trend_cookies,
         headers=trend_headers,
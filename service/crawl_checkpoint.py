@@ -0,0 +1,103 @@
+import json
+import os
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Optional
+
+
+CHECKPOINT_DIR = 'csv/checkpoints'
+REVIEW_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f%z'
+
+# checkpoint status
+CRAWLING = 'crawling'      # first full crawl of the product
+REFRESHING = 'refreshing'  # fetching reviews newer than the high-water mark
+DONE = 'done'
+
+
+def parse_review_time(review_time: str):
+    return datetime.strptime(review_time, REVIEW_TIME_FORMAT)
+
+
+@dataclass
+class CrawlCheckpoint:
+    """Crawl progress of one product, keyed by (merchantNo, originProductNo).
+
+    Reviews are crawled newest first. ``last_page``/``last_review_*`` point at the last review
+    written by the running pass, so an interrupted pass continues after it. ``high_water_*`` is the
+    newest review in the store, a refresh stops as soon as it reaches it.
+    """
+    merchant_no: int
+    product_no: int
+    status: Optional[str] = None
+    last_page: int = 0
+    last_review_id: Optional[int] = None
+    last_review_date: Optional[str] = None
+    high_water_id: Optional[int] = None
+    high_water_date: Optional[str] = None
+    pass_high_water_id: Optional[int] = None
+    pass_high_water_date: Optional[str] = None
+
+    @staticmethod
+    def path_for(merchant_no, product_no):
+        return os.path.join(CHECKPOINT_DIR, '{}_{}.json'.format(merchant_no, product_no))
+
+    @property
+    def path(self):
+        return self.path_for(self.merchant_no, self.product_no)
+
+    @classmethod
+    def load(cls, merchant_no, product_no):
+        path = cls.path_for(merchant_no, product_no)
+        if not os.path.exists(path):
+            return cls(merchant_no, product_no)
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(**json.load(file))
+
+    def save(self):
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(asdict(self), file)
+        os.replace(tmp_path, self.path)
+
+    def start_pass(self):
+        # an interrupted pass keeps its page and review position
+        if self.status in (CRAWLING, REFRESHING):
+            return
+        self.status = CRAWLING if self.status is None else REFRESHING
+        self.last_page = 0
+        self.last_review_id = None
+        self.last_review_date = None
+        self.pass_high_water_id = None
+        self.pass_high_water_date = None
+        self.save()
+
+    def finish_pass(self):
+        if self.pass_high_water_date is not None:
+            self.high_water_id = self.pass_high_water_id
+            self.high_water_date = self.pass_high_water_date
+        self.status = DONE
+        self.save()
+
+    def is_old(self, item):
+        """True if the review is not newer than the store's high-water mark."""
+        if self.status != REFRESHING or self.high_water_date is None:
+            return False
+        if item.get('id') is not None and item.get('id') == self.high_water_id:
+            return True
+        return parse_review_time(item['createDate']) < parse_review_time(self.high_water_date)
+
+    def is_written(self, item):
+        """True if the review was already written by the running pass (pages shift as reviews arrive)."""
+        if self.last_review_date is None:
+            return False
+        if item.get('id') is not None and item.get('id') == self.last_review_id:
+            return True
+        return parse_review_time(item['createDate']) > parse_review_time(self.last_review_date)
+
+    def mark_written(self, item):
+        if self.pass_high_water_date is None:
+            self.pass_high_water_id = item.get('id')
+            self.pass_high_water_date = item['createDate']
+        self.last_review_id = item.get('id')
+        self.last_review_date = item['createDate']
@@ -11,3 +11,11 @@ class NotEnoughSearchVolumeError(Exception):
     
     def __str__(self):
         return 'NotEnoughSearchVolumeError: '+ self.msg
+
+
+class NotSupportedUrlError(Exception):
+    def __init__(self, msg='Only smartstore.naver.com and brand.naver.com product urls are supported.'):
+        self.msg = msg
+
+    def __str__(self):
+        return 'NotSupportedUrlError: ' + self.msg
@@ -1,58 +1,240 @@
+import os
 import pandas as pd
 import numpy as np
 from bertopic.representation import KeyBERTInspired
 from bertopic import BERTopic
-from service.text_preprocessing import TextPreprocessing, SimpleTokenizerForBERTopic
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from bertopic.backend import BaseEmbedder
+from service.text_preprocessing import month_label
+from service.tokenized_corpus import TokenizedCorpus
+from service.term_matrix import TermMatrixVectorizer
+from service.model_registry import model_registry, embedding_model_name
+from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import normalize
-from datetime import datetime, timezone
-from collections import defaultdict
-from util.time_similarity_metric import pearson_corr, mse, dynamic_time_warping, minmax_scaler
+from sklearn.decomposition import PCA
+from sklearn.cluster import MiniBatchKMeans
+import scipy.sparse as sp
+from util.time_similarity_metric import minmax_scaler, pearson_corr_many, mse_many, top_k, dtw_top_k
+
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+# 'default' (UMAP + HDBSCAN) or 'fast' (PCA + mini-batch k-means), see build_topic_model
+TOPIC_MODEL_MODE = os.environ.get('TOPIC_MODEL_MODE', 'default')
+FAST_PCA_COMPONENTS = int(os.environ.get('FAST_PCA_COMPONENTS', 10))
+# fit on a stratified sample of this many reviews and assign the rest to its topics, 0 = fit on all
+TOPIC_SAMPLE_SIZE = int(os.environ.get('TOPIC_SAMPLE_SIZE', 0))
+TRANSFORM_BATCH_SIZE = int(os.environ.get('TRANSFORM_BATCH_SIZE', 10000))
+if TRANSFORM_BATCH_SIZE < 1:
+    raise ValueError('TRANSFORM_BATCH_SIZE must be positive, got {}'.format(TRANSFORM_BATCH_SIZE))
+SAMPLE_NEIGHBORS = 15
+
+
+def topic_term_counts(topic_model, documents, groups, n_groups, X):
+    """Word counts of the joined documents of every group, like BERTopic's _c_tf_idf counts them.
+
+    X holds the counts of documents as they are. BERTopic runs _preprocess_text on each joined document
+    first; it works character by character, so it is applied to the documents here: the ones it changes
+    are counted again from their cleaned text, and a group of one document cleaned to nothing counts as
+    "emptydoc". BERTopic's language is None when it gets an embedding model, then only tabs, newlines and
+    empty documents change, which preprocessing never keeps.
+    """
+    vectorizer = topic_model.vectorizer_model
+    documents = np.asarray(documents, dtype=object)
+    cleaned = np.asarray(topic_model._preprocess_text(documents), dtype=object)
+    empty = (cleaned == 'emptydoc') & (documents != 'emptydoc')
+    changed = np.flatnonzero((cleaned != documents) & ~empty)
+    if empty.any() or len(changed):
+        X = X.tolil(copy=True)
+        X[np.flatnonzero(empty)] = 0
+        if len(changed):
+            X[changed] = vectorizer.transform(cleaned[changed].tolist())
+        X = X.tocsr()
+
+    indicator = sp.csr_matrix((np.ones(len(documents), dtype=np.int64), (groups, np.arange(len(documents)))),
+                              shape=(n_groups, len(documents)))
+    counts = indicator @ X
+    lone_empty = np.flatnonzero((np.bincount(groups, minlength=n_groups) == 1) &
+                                (np.bincount(groups, weights=empty, minlength=n_groups) == 1))
+    if len(lone_empty):
+        counts = counts.tolil()
+        counts[lone_empty] = vectorizer.transform(['emptydoc'])
+    return counts.tocsr()
+
+
+class RegistryEmbedder(BaseEmbedder):
+    """BERTopic embedding backend that takes its model from model_registry when it first embeds.
+
+    Documents come with their embeddings, only KeyBERTInspired embeds (the topic words), so a topic
+    worker loads the model with its first stage instead of when it starts.
+    """
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def embed(self, documents, verbose=False):
+        return model_registry.get(self.name).encode(documents, show_progress_bar=verbose)
+
+
+class TermMatrixBERTopic(BERTopic):
+    """BERTopic that sums the document rows of a TermMatrixVectorizer per topic.
+
+    BERTopic joins the documents of every topic into one string and vectorizes it again; the counts of a
+    joined document are the sum of its documents' counts, so the c-TF-IDF is the same without the join
+    (see topic_term_counts).
+    """
+    def _extract_topics(self, documents, embeddings=None, mappings=None):
+        X = self.vectorizer_model.transform(documents.Document.values)
+        topics, topic_of_doc = np.unique(documents.Topic.values.astype(np.int64), return_inverse=True)
+        counts = topic_term_counts(self, documents.Document.values, topic_of_doc, len(topics), X)
+        self.ctfidf_model = self.ctfidf_model.fit(counts)
+        self.c_tf_idf_ = self.ctfidf_model.transform(counts)
+        words = self.vectorizer_model.get_feature_names_out()
+        self.topic_representations_ = self._extract_words_per_topic(words, documents)
+        self._create_topic_vectors(documents=documents, embeddings=embeddings, mappings=mappings)
+        self.topic_labels_ = {key: f"{key}_" + "_".join([word[0] for word in values[:4]])
+                              for key, values in
+                              self.topic_representations_.items()}
+
+
+def build_topic_model(embedding_model, vectorizer, n_topic=5, mode='default', n_documents=None, representation_model=None):
+    """BERTopic model of one topic stage, vectorizer is the TermMatrixVectorizer of its documents.
+
+    'default' clusters UMAP-reduced embeddings with HDBSCAN and merges the clusters down to n_topic
+    topics, the outlier topic -1 included. 'fast' reduces with PCA and clusters with mini-batch k-means
+    straight into n_topic - 1 topics; k-means leaves no outliers, so both modes hand topics
+    0 .. n_topic - 2 to get_topics_with_keyword. Its cost grows about linearly with the documents.
+    n_documents, the number of documents the model is fitted on, caps the fast mode's components and clusters.
+    """
+    if mode not in ('default', 'fast'):
+        raise ValueError('unknown topic model mode {}'.format(mode))
+    representation_model = KeyBERTInspired() if representation_model is None else representation_model
+    if mode == 'default':
+        return TermMatrixBERTopic(embedding_model=embedding_model,
+                                  representation_model=representation_model,
+                                  vectorizer_model=vectorizer,
+                                  nr_topics=n_topic,
+                                  top_n_words=30,
+                                  calculate_probabilities=True)
+
+    n_components, n_clusters = FAST_PCA_COMPONENTS, n_topic - 1
+    if n_documents is not None:
+        # PCA and k-means fail on fewer documents than components or clusters
+        n_components = max(1, min(n_components, n_documents - 1))
+        n_clusters = max(1, min(n_clusters, n_documents))
+    return TermMatrixBERTopic(embedding_model=embedding_model,
+                              umap_model=PCA(n_components=n_components, random_state=42),
+                              hdbscan_model=MiniBatchKMeans(n_clusters=n_clusters, batch_size=1024, n_init=3, random_state=42),
+                              representation_model=representation_model,
+                              vectorizer_model=vectorizer,
+                              top_n_words=30)
+
+
+def nearest_topics(sample, sample_topics, vectors, k=SAMPLE_NEIGHBORS):
+    """Majority topic of the k most cosine-similar sample rows of every vector, rows are l2-normalized.
+
+    Ties go to the lower topic, -1 (outliers) included.
+    """
+    similarity = vectors @ sample.T
+    k = min(k, sample.shape[0])
+    neighbors = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    labels = sample_topics[neighbors] + 1
+    votes = np.zeros((len(vectors), sample_topics.max() + 2), dtype=np.int64)
+    np.add.at(votes, (np.repeat(np.arange(len(vectors)), k), labels.ravel()), 1)
+    return votes.argmax(axis=1) - 1
+
 
 class FeatureExtraction:
-    def __init__(self):
-        self.csv_path = ''
-        self.raw_data = None
+    def __init__(self, corpus=None, csv_path=''):
+        # a corpus given here is used for csv_path instead of reading it again
+        self.csv_path = csv_path
+        self.corpus = corpus
         self.product_name = None
         self.topic_model = None
         self.n_topic = None
         self.timestamps = None
+        self.months = None
         self.documents = None
+        self.terms = None
+        self.topic_word_per_month = None
         self.word_tfidf_per_month = None
         self.word_set = None
+        self._word_series = {}
 
-    def train_topic_model_with_bertopic(self, csv_path, product_name, n_topic=5, star_rating_range=None):
-        self.csv_path = csv_path
-        self.raw_data = pd.read_csv(csv_path)
-        custom_tokenizer = SimpleTokenizerForBERTopic()
-        vectorizer = CountVectorizer(tokenizer=custom_tokenizer, max_features=3000)
-        representation_model = KeyBERTInspired()
-
-        text_pp = TextPreprocessing()
-        text_pp.proprocess_text(self.raw_data, product_name=product_name, star_rating_range=star_rating_range)
-
-        model = BERTopic(embedding_model="beomi/KcELECTRA-base-v2022",
-                         representation_model=representation_model,
-                         vectorizer_model=vectorizer,
-                         nr_topics=n_topic,
-                         top_n_words=30,
-                         calculate_probabilities=True)
-        print(text_pp.documents[:10])
-        model.fit_transform(text_pp.documents) #[:100])
+    def load_corpus(self, csv_path):
+        # the pros, cons and DTM models of a job share one tokenization of its reviews
+        if self.corpus is None or self.csv_path != csv_path:
+            self.corpus = TokenizedCorpus.from_reviews(csv_path)
+            self.csv_path = csv_path
+        return self.corpus
+
+    @staticmethod
+    def get_embedding_model():
+        return model_registry.get(embedding_model_name())
+
+    def train_topic_model_with_bertopic(self, csv_path, product_name, n_topic=5, star_rating_range=None, mode=None,
+                                        sample_size=None):
+        corpus = self.load_corpus(csv_path)
+        # every document is embedded once per job, the star-rating views select rows of the matrix
+        if corpus.embeddings is None:
+            corpus.embed(self.get_embedding_model(), batch_size=EMBEDDING_BATCH_SIZE)
+        corpus = corpus.view(star_rating_range)
+        sample_size = TOPIC_SAMPLE_SIZE if sample_size is None else sample_size
+        fit_rows = corpus.sample_rows(sample_size) if sample_size else np.arange(len(corpus))
+        mode = TOPIC_MODEL_MODE if mode is None else mode
+        documents = corpus.documents
+        # word counts come from the corpus' term matrix, documents are not split again
+        vectorizer = TermMatrixVectorizer(corpus.terms, corpus.words, documents)
+        model = build_topic_model(RegistryEmbedder(embedding_model_name()), vectorizer, n_topic=n_topic, mode=mode,
+                                  n_documents=len(fit_rows))
+        print(documents[:10])
+        if len(fit_rows) == len(corpus):
+            model.fit_transform(documents, embeddings=corpus.embeddings) #[:100])
+        else:
+            self._fit_on_sample(model, documents, corpus.embeddings, fit_rows, mode)
         self.topic_model = model
         self.n_topic = n_topic
-        self.timestamps = text_pp.timestamps
-        self.documents = text_pp.documents
+        self.timestamps = corpus.timestamps
+        self.months = corpus.month_indices
+        self.documents = documents
+        self.terms = corpus.terms
         print('traning end')
         if star_rating_range is None:
-            return self.raw_data.content[:10].values.tolist(), [{'document': text_pp.original_doc[i], 
+            original_doc = corpus.original_doc
+            months = corpus.months
+            star_rating_list = corpus.star_rating_list
+            return corpus.head, [{'document': original_doc[i],
                                                                  'tokens': self.documents[i], 
                                                                  'topic': self.topic_model.topics_[i], 
-                                                                 'month': '{}. {}.'.format(self.timestamps[i].year, self.timestamps[i].month), 
-                                                                 'star_rating': text_pp.star_rating_list[i],
+                                                                 'month': months[i],
+                                                                 'star_rating': star_rating_list[i],
                                                                  'representative_topic': None} for i in range(len(self.timestamps))]
 
 
+    @staticmethod
+    def _fit_on_sample(model, documents, embeddings, fit_rows, mode, batch_size=TRANSFORM_BATCH_SIZE):
+        """Fits model on the fit_rows documents and assigns the others in batches.
+
+        Topic words, c-TF-IDF and representative docs come from the sample, topics_ covers every document.
+        The fast mode's PCA + k-means predict directly; UMAP's transform is slower than a full fit for samples
+        below 4096 documents, so in the default mode a document takes the topic of its nearest sampled ones.
+        """
+        print('fitting on {} of {} documents'.format(len(fit_rows), len(documents)))
+        model.fit_transform([documents[i] for i in fit_rows], embeddings=embeddings[fit_rows])
+        # words only the other documents use have an infinite idf, they get no weight in the monthly c-TF-IDF
+        idf = model.ctfidf_model._idf_diag
+        idf.data[~np.isfinite(idf.data)] = 0
+        topics = np.empty(len(documents), dtype=np.int64)
+        topics[fit_rows] = model.topics_
+        rest = np.setdiff1d(np.arange(len(documents)), fit_rows)
+        # only the labels are used, HDBSCAN's membership vectors would cost more than the fit saves
+        model.calculate_probabilities = False
+        sample = normalize(embeddings[fit_rows])
+        for start in range(0, len(rest), batch_size):
+            rows = rest[start:start + batch_size]
+            if mode == 'fast':
+                topics[rows], _ = model.transform([documents[i] for i in rows], embeddings=embeddings[rows])
+            else:
+                topics[rows] = nearest_topics(sample, topics[fit_rows], normalize(embeddings[rows]))
+        model._update_topic_size(pd.DataFrame({'Document': documents, 'Topic': topics}))
+
     def optimize_topic_number(self):
         raise "not implemented"
 
@@ -72,7 +254,30 @@ class FeatureExtraction:
                 
         return ret, rep_docs
 
-    def get_topics_per_month(self):
+    def _c_tf_idf_per_month(self, documents):
+        """l1-normalized c-TF-IDF of every (month, topic) pair of documents in one sparse pass.
+
+        Equals running topic_model._c_tf_idf on the joined documents of each pair month by month:
+        the word counts of a joined document are the sum of its documents' rows in the term matrix (see
+        topic_term_counts), and the c-TF-IDF transform and the normalization work row by row. Returns the
+        pair index, its document counts, the matrix with one row per pair (sorted by month, topic) and the vocabulary.
+        """
+        topic_model = self.topic_model
+        grouped = documents.groupby(['Timestamps', 'Topic'], sort=True)
+        pair_of_doc = grouped.ngroup().to_numpy()
+        frequency = grouped.size()
+        counts = topic_term_counts(topic_model, documents.Document.values, pair_of_doc, len(frequency), self.terms)
+        c_tf_idf = topic_model.ctfidf_model.transform(counts)
+        c_tf_idf = normalize(c_tf_idf, axis=1, norm='l1', copy=False).tocsr()
+        return frequency.index, frequency.to_numpy(), c_tf_idf, topic_model.vectorizer_model.get_feature_names_out()
+
+    def get_topics_per_month(self, evolution_tuning=False):
+        """Topic words and frequency per month.
+
+        evolution_tuning averages a topic's c-TF-IDF with its (tuned) c-TF-IDF of the previous month
+        like BERTopic's topics_over_time. It is off by default: the month loop this replaced meant to do
+        it but wrote the average into a temporary copy, so its output was never tuned.
+        """
         labels = self.topic_model.topics_
 
         # 임시 제한
@@ -80,111 +285,91 @@ class FeatureExtraction:
         # self.documents = self.documents[:100]
         # self.timestamps = self.timestamps[:100]
 
-        sorted_timestamps = sorted(self.timestamps)
-        min_year = sorted_timestamps[0].year
-        min_month = sorted_timestamps[0].month
-        max_year = sorted_timestamps[-1].year
-        max_month = sorted_timestamps[-1].month
-
-        # per month
-        now_year = min_year
-        now_month = min_month
         topics_over_time = []
         topic_word_per_month = {}
 
-        documents = pd.DataFrame({"Document": self.documents, "Topic": labels, "Timestamps": self.timestamps})
-
-        while not now_year < max_year or (now_year == max_year and now_month <= max_month):
-            
-            start_time = datetime(now_year, now_month, 1).astimezone(timezone.utc)
-            end_time = datetime(now_year if now_month < 12 else now_year + 1, now_month + 1 if now_month < 12 else 1,
-                                1).astimezone(timezone.utc)
-            dddf = documents[documents['Timestamps'] >= start_time]
-            selection = dddf[dddf['Timestamps'] < end_time]
-            documents_per_topic = selection.groupby(['Topic'], as_index=False).agg({'Document': ' '.join,
-                                                                                    "Timestamps": "count"})
-            try:
-                c_tf_idf, words = self.topic_model._c_tf_idf(documents_per_topic, fit=False)
-                c_tf_idf = normalize(c_tf_idf, axis=1, norm='l1', copy=False)
-            except:
-                now_year = now_year if now_month < 12 else now_year + 1
-                now_month = now_month + 1 if now_month < 12 else 1
-                continue
-
-            if not (now_year == min_year and now_month == min_month):
-                current_topics = sorted(list(documents_per_topic.Topic.values))
-                overlapping_topics = sorted(list(set(previous_topics).intersection(set(current_topics))))
+        # per month, months without reviews have no rows
+        documents = pd.DataFrame({"Document": self.documents, "Topic": labels, "Timestamps": self.months})
+        pairs, frequency, c_tf_idf, words = self._c_tf_idf_per_month(documents)
+        pair_months = pairs.get_level_values(0).to_numpy()
+        pair_topics = pairs.get_level_values(1).to_numpy()
+        month_rows = documents.groupby('Timestamps', sort=True).indices
 
-                current_overlap_idx = [current_topics.index(topic) for topic in overlapping_topics]
-                previous_overlap_idx = [previous_topics.index(topic) for topic in overlapping_topics]
+        previous_topics = None
+        for month, rows in month_rows.items():
+            start, end = np.searchsorted(pair_months, [month, month + 1])
+            current_topics = pair_topics[start:end]
+            month_c_tf_idf = c_tf_idf[start:end]
 
-                c_tf_idf.tolil()[current_overlap_idx] = ((c_tf_idf[current_overlap_idx] +
-                                                          previous_c_tf_idf[previous_overlap_idx]) / 2.0).tolil()
+            if evolution_tuning and previous_topics is not None:
+                _, current_overlap_idx, previous_overlap_idx = np.intersect1d(current_topics, previous_topics,
+                                                                              assume_unique=True, return_indices=True)
+                tuned = month_c_tf_idf.toarray()
+                tuned[current_overlap_idx] = (tuned[current_overlap_idx] + previous_c_tf_idf[previous_overlap_idx]) / 2.0
+                month_c_tf_idf = sp.csr_matrix(tuned)
 
-            words_per_topic = self.topic_model._extract_words_per_topic(words, selection, c_tf_idf, calculate_aspects=False)
-            topic_word_per_month['{}. {}.'.format(now_year, now_month)] = words_per_topic
-            topic_frequency = pd.Series(documents_per_topic.Timestamps.values,
-                                        index=documents_per_topic.Topic).to_dict()
+            label = month_label(month)
+            selection = documents.iloc[rows]
+            words_per_topic = self.topic_model._extract_words_per_topic(words, selection, month_c_tf_idf, calculate_aspects=False)
+            topic_word_per_month[label] = words_per_topic
+            topic_frequency = dict(zip(current_topics.tolist(), frequency[start:end].tolist()))
 
             topics_at_timestamp = [(topic,
                                     ", ".join([words[0] for words in values][:30]),
                                     topic_frequency[topic],
-                                    '{}. {}.'.format(now_year, now_month)) for topic, values in words_per_topic.items()]
+                                    label) for topic, values in words_per_topic.items()]
             topics_over_time.extend(topics_at_timestamp)
 
-            previous_topics = sorted(list(documents_per_topic.Topic.values))
-            previous_c_tf_idf = c_tf_idf.copy()
+            previous_topics = current_topics
+            previous_c_tf_idf = month_c_tf_idf.toarray()
 
-            now_year = now_year if now_month < 12 else now_year + 1
-            now_month = now_month + 1 if now_month < 12 else 1
-
-        word_tfidf_per_time, word_set = self._get_word_tfidf_per_month(topic_word_per_month, topic_idx=1)
-        # print('test', word_tfidf_per_time)
-        self.word_tfidf_per_month = word_tfidf_per_time
-        self.word_set = word_set
+        self.topic_word_per_month = topic_word_per_month
+        self._word_series = {}
+        words, series = self.get_word_series(1)
+        self.word_tfidf_per_month = dict(zip(words, series))
+        self.word_set = set(words)
         dtm = pd.DataFrame(topics_over_time, columns=["topic", "words", "Frequency", "Timestamp"])
 
         return dtm
 
     @staticmethod
     def _get_word_tfidf_per_month(topic_word_per_month, topic_idx):
-        word_tfidf_per_time = defaultdict(list)
-        word_set = set()
-        for idx, time in enumerate(topic_word_per_month.keys()):
-            try:
-                for idx2, wp in enumerate(topic_word_per_month[time][topic_idx]):
-                    w, p = wp
-                    if not w in word_set:
-                        word_set.add(w)
-                        for _ in range(idx):
-                            word_tfidf_per_time[w].append(0)
-
-                    if len(word_tfidf_per_time[w]) == idx:
-                        word_tfidf_per_time[w].append(p)
-                    else:
-                        word_tfidf_per_time[w][-1] += p
-
-                for w in list(word_set):
-                    if idx + 1 != len(word_tfidf_per_time[w]):
-                        word_tfidf_per_time[w].append(0)
-            except KeyError:
-                pass
-
-        return word_tfidf_per_time, word_set
-
-    def get_keywords_with_time_series(self, dtm, topic_idx, metric='pearson', top_n_words=5):
+        """Word scores of a topic as a (words x months) matrix over the months the topic appears in.
+
+        A word listed twice in a month is summed, months where it is not listed are 0.
+        """
+        month_words = [words_per_topic[topic_idx] for words_per_topic in topic_word_per_month.values()
+                       if topic_idx in words_per_topic]
+        word_row = {}
+        rows, cols, values = [], [], []
+        for col, word_scores in enumerate(month_words):
+            for w, p in word_scores:
+                rows.append(word_row.setdefault(w, len(word_row)))
+                cols.append(col)
+                values.append(p)
+        series = np.zeros((len(word_row), len(month_words)))
+        np.add.at(series, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), values)
+        return list(word_row), series
+
+    def get_word_series(self, topic_idx):
+        if topic_idx not in self._word_series:
+            self._word_series[topic_idx] = self._get_word_tfidf_per_month(self.topic_word_per_month, topic_idx)
+        return self._word_series[topic_idx]
+
+    def get_keywords_with_time_series(self, dtm, topic_idx, metric='pearson', top_n_words=5, dtw_window=None):
         metric_li = ['pearson', 'mse', 'dtw']
-        topic_freq = dtm.loc[dtm.Topic == topic_idx, 'Frequency'].values
+        topic_freq = dtm.loc[dtm.topic == topic_idx, 'Frequency'].values
 
         if not metric in metric_li:
             raise "metric should be one of the {}.".format(metric_li)
 
-        loss_func = {'pearson': pearson_corr, 'mse': mse, 'dtw': dynamic_time_warping}
-        s_idx = []
-        corr = []
-        for w in list(self.word_set):
-            s_idx.append(w)
-            corr.append(loss_func[metric](np.array(self.word_tfidf_per_month[w]), minmax_scaler(topic_freq)))
+        words, series = self.get_word_series(topic_idx)
+        target = minmax_scaler(topic_freq)
+        if metric == 'dtw':
+            # dtw_window is a Sakoe-Chiba band in months, None compares every month pair
+            best, scores = dtw_top_k(series, target, top_n_words, window=dtw_window)
+            return pd.Series(scores, index=[words[i] for i in best])
 
-        corr_res = pd.Series(corr, index=s_idx)
-        return corr_res.sort_values(ascending=False if metric == 'pearson' else True)[:top_n_words]
\ No newline at end of file
+        scores = pearson_corr_many(series, target) if metric == 'pearson' else mse_many(series, target)
+        best = top_k(scores, top_n_words, largest=metric == 'pearson')
+        return pd.Series(scores[best], index=[words[i] for i in best])
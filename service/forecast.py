@@ -1,12 +1,70 @@
+import os
+import warnings
 import torch
+import torch.nn as nn
 import pandas as pd
 import numpy as np
-import pytorch_lightning as pl
 from service.GTM import GTM
 from pathlib import Path
 from sklearn.preprocessing import MinMaxScaler
-from sentence_transformers import SentenceTransformer
 from service.crawl import get_search_volume
+from service.model_registry import model_registry, embedding_model_name
+
+GTM_MODEL = 'gtm-summed'
+GTM_CHECKPOINT = os.environ.get('GTM_CHECKPOINT', 'util/gtm-summed.ckpt')
+# hyperparameters the checkpoint was trained with
+GTM_CONFIG = dict(embedding_dim=32, hidden_dim=64, output_dim=52, num_heads=4, num_layers=1, use_text=1, use_img=0,
+                  trend_len=157, num_trends=2, use_encoder_mask=1, autoregressive=0, gpu_num=0)
+
+
+def build_gtm(checkpoint=GTM_CHECKPOINT):
+    model = GTM(**GTM_CONFIG)
+    model.load_state_dict(torch.load(checkpoint, map_location=torch.device('cpu'))['state_dict'], strict=False)
+    return model.eval()
+
+
+def _drop_dropout(module):
+    # dropout does nothing in eval mode, without the modules the graph has fewer nodes
+    for name, child in module.named_children():
+        if isinstance(child, nn.Dropout):
+            setattr(module, name, nn.Identity())
+        else:
+            _drop_dropout(child)
+    return module
+
+
+class ForecastEngine:
+    """GTM prepared once for inference: eval mode, no dropout, no gradients and a traced, frozen graph.
+
+    The graph is traced for trend_len weeks of trends, other lengths run the eager model.
+    """
+    def __init__(self, model, trace=True):
+        self.model = _drop_dropout(model.eval()).requires_grad_(False)
+        self.trend_len = GTM_CONFIG['trend_len']
+        self.graph = None
+        if trace:
+            text = torch.zeros(1, 768)
+            trends = torch.zeros(1, GTM_CONFIG['num_trends'], self.trend_len)
+            with torch.no_grad(), warnings.catch_warnings():
+                # the mask is fixed for trend_len weeks, predict runs other lengths eagerly
+                warnings.simplefilter('ignore', torch.jit.TracerWarning)
+                self.graph = torch.jit.freeze(torch.jit.trace(self.model, (text, trends)))
+
+    def predict(self, text_embedding, trends):
+        """Forecast of one product from its text embedding (768,) and min-max scaled trends (num_trends x weeks)."""
+        text = torch.as_tensor(np.asarray(text_embedding, dtype=np.float32)).reshape(1, -1)
+        trends = torch.as_tensor(np.asarray(trends, dtype=np.float32)).unsqueeze(0)
+        model = self.graph if self.graph is not None and trends.shape[-1] == self.trend_len else self.model
+        with torch.inference_mode():
+            forecast, _ = model(text, trends)
+        return forecast.numpy().flatten()[:GTM_CONFIG['output_dim']]
+
+
+def _load_forecast_engine(name):
+    return ForecastEngine(build_gtm())
+
+
+model_registry.register(GTM_MODEL, _load_forecast_engine)
 
 
 def predict_trend(text, product_name, category, url):
@@ -26,40 +84,13 @@ def predict_trend(text, product_name, category, url):
     cat_trend = MinMaxScaler().fit_transform(cat_trend.reshape(-1, 1)).flatten()
     multitrends = np.vstack([product_trend, cat_trend])
 
-    former_trend = [multitrends]
-    former_trend = torch.FloatTensor(np.array(former_trend))
-
-
     print(text, 'embedding start')
-    embedding_model = SentenceTransformer('beomi/KcELECTRA-base-v2022')
-    text = torch.FloatTensor(embedding_model.encode([text]))
+    embedding_model = model_registry.get(embedding_model_name())
+    text = embedding_model.encode([text])[0]
     print('embedding end')
 
-    device = torch.device(f'cpu')
-    pl.seed_everything(21)
-
-    model = GTM(
-            embedding_dim=32,
-            hidden_dim=64,
-            output_dim=52,
-            num_heads=4,
-            num_layers=1,
-            use_text=1,
-            use_img=0,
-            trend_len=157,
-            num_trends=2,
-            use_encoder_mask=1,
-            autoregressive=0,
-            gpu_num=0
-        )
-    
-    print('load start')
-    model.load_state_dict(torch.load('util/gtm-summed.ckpt', map_location=device)['state_dict'], strict=False)
-    print('load end')
-    model.to(device)
-    model.eval()
-    y_pred, att = model(text, former_trend)
-    y_pred = y_pred.detach().cpu().numpy().flatten()[:52]
+    # loaded and traced on the first forecast of the process
+    y_pred = model_registry.get(GTM_MODEL).predict(text, multitrends)
     print(y_pred)
     final_y = 100*(y_pred-np.min(y_pred))/(np.max(y_pred)-np.min(y_pred))
     return product_trend, final_y, start_date, end_date
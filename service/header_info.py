@@ -45,3 +45,27 @@ trend_headers = {
     'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36',
     'x-requested-with': 'XMLHttpRequest',
 }
+
+
+datalab_cookies = {
+    'NNB': '55CLS2SUU3DWK',
+    '_datalab_cid': '50000000',
+}
+
+datalab_headers = {
+    'authority': 'datalab.naver.com',
+    'accept': '*/*',
+    'accept-language': 'ko-KR,ko;q=0.9',
+    'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
+    # 'cookie': 'NNB=WNMPDB3YQHDWK; _datalab_cid=50000000',
+    'origin': 'https://datalab.naver.com',
+    'referer': 'https://datalab.naver.com/keyword/trendResult.naver',
+    'sec-ch-ua': '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-origin',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+    'x-requested-with': 'XMLHttpRequest',
+}
@@ -0,0 +1,223 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# requests per second, per host
+DEFAULT_RATE = float(os.environ.get('HTTP_DEFAULT_RATE', 5))
+RATE_LIMITS = {
+    'smartstore.naver.com': float(os.environ.get('SMARTSTORE_RATE', 10)),
+    'brand.naver.com': float(os.environ.get('BRAND_RATE', 10)),
+    'datalab.naver.com': float(os.environ.get('DATALAB_RATE', 2)),
+}
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 4))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+PENALTY_WINDOW = 1.0
+REQUEST_TIMEOUT = 30
+
+
+class TokenBucket:
+    """Token bucket whose rate backs off on 429 answers and recovers on successes.
+
+    ``reserve`` takes a token and returns how long the caller has to wait before using it,
+    so the same bucket serves threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+    def __init__(self, rate, burst=None, min_rate=0.2):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.penalized = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def penalize(self):
+        with self._lock:
+            # concurrent requests of one burst get their 429s together, halve once per burst
+            now = time.monotonic()
+            if now - self.penalized < PENALTY_WINDOW:
+                return
+            self.penalized = now
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class HttpClient:
+    """Outbound http for all crawl functions: per-host rate limits, retries and counters."""
+    def __init__(self, rate_limits=None, default_rate=DEFAULT_RATE, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, timeout=REQUEST_TIMEOUT):
+        self.rate_limits = dict(RATE_LIMITS if rate_limits is None else rate_limits)
+        self.default_rate = default_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        # origin -> origin, lets benchmarks point the crawler at a local server
+        self.host_overrides = {}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'retries': 0, 'errors': 0, 'throttled_waits': 0,
+                       'throttled_seconds': 0.0, 'bytes': 0}
+
+    def set_rate_limit(self, host, rate, burst=None):
+        with self._lock:
+            self.rate_limits[host] = rate
+            self._buckets[host] = TokenBucket(rate, burst)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _bucket(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_limits.get(host, self.default_rate))
+                self._buckets[host] = bucket
+            return bucket
+
+    def _rewrite(self, url):
+        parts = urlsplit(url)
+        origin = '{}://{}'.format(parts.scheme, parts.netloc)
+        target = self.host_overrides.get(origin)
+        if target is None:
+            return url
+        return target + url[len(origin):]
+
+    def _throttle_delay(self, host):
+        wait = self._bucket(host).reserve()
+        if wait > 0:
+            self._count('throttled_waits')
+            self._count('throttled_seconds', wait)
+        return wait
+
+    def _retry_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        # full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _should_retry(self, host, status, attempt):
+        if status not in RETRY_STATUS:
+            self._bucket(host).reward()
+            return False
+        if status == 429:
+            self._bucket(host).penalize()
+        return attempt < self.max_retries
+
+    def request(self, method, url, **kwargs):
+        host = urlsplit(url).netloc
+        url = self._rewrite(url)
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            time.sleep(self._throttle_delay(host))
+            self._count('requests')
+            try:
+                res = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._count('errors')
+                if attempt >= self.max_retries:
+                    raise
+                self._count('retries')
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+
+            self._count('bytes', len(res.content))
+            if self._should_retry(host, res.status_code, attempt):
+                self._count('retries')
+                time.sleep(self._retry_delay(attempt, res.headers.get('Retry-After')))
+                attempt += 1
+                continue
+            if res.status_code in RETRY_STATUS:
+                self._count('errors')
+                res.raise_for_status()
+            return res
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    async def async_request(self, session, method, url, **kwargs):
+        """Same as ``request`` over an aiohttp session, returns (status, text)."""
+        host = urlsplit(url).netloc
+        url = self._rewrite(url)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._throttle_delay(host))
+            self._count('requests')
+            try:
+                async with session.request(method, url, **kwargs) as res:
+                    body = await res.read()
+                    status = res.status
+                    retry_after = res.headers.get('Retry-After')
+                    request_info = res.request_info
+                    text = body.decode(res.charset or 'utf-8', errors='replace')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self._count('errors')
+                if attempt >= self.max_retries:
+                    raise
+                self._count('retries')
+                await asyncio.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+
+            self._count('bytes', len(body))
+            if self._should_retry(host, status, attempt):
+                self._count('retries')
+                await asyncio.sleep(self._retry_delay(attempt, retry_after))
+                attempt += 1
+                continue
+            if status in RETRY_STATUS:
+                self._count('errors')
+                raise aiohttp.ClientResponseError(request_info, (), status=status, message=text[:200])
+            return status, text
+
+
+http_client = HttpClient()
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+
+EMBEDDING_MODEL = 'beomi/KcELECTRA-base-v2022'
+# 'fp32' or 'int8' (dynamically quantized linear layers, faster on CPU, see benchmark/embedding_benchmark.py)
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'fp32')
+# characters per embedding batch, short reviews are batched together and long ones get small batches
+EMBEDDING_CHAR_BUDGET = int(os.environ.get('EMBEDDING_CHAR_BUDGET', 8192))
+# comma separated model names loaded when the app starts, e.g. PRELOAD_MODELS=beomi/KcELECTRA-base-v2022
+PRELOAD_MODELS = [name for name in os.environ.get('PRELOAD_MODELS', '').split(',') if name]
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def _parameter_bytes(model):
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except AttributeError:
+        return None
+
+
+def _load_sentence_transformer(name):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+
+def _load_int8_sentence_transformer(name):
+    import torch
+    model = _load_sentence_transformer(name[:-len(':int8')])
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def embedding_model_name(backend=None):
+    backend = EMBEDDING_BACKEND if backend is None else backend
+    if backend not in ('fp32', 'int8'):
+        raise ValueError('unknown embedding backend {}'.format(backend))
+    return EMBEDDING_MODEL if backend == 'fp32' else EMBEDDING_MODEL + ':int8'
+
+
+def encode_length_bucketed(model, texts, batch_size=64, char_budget=EMBEDDING_CHAR_BUDGET):
+    """model.encode over batches of similar length, a batch holds at most char_budget padded characters.
+
+    Returns float32 vectors in the order of texts.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    vectors = [None] * len(texts)
+    start = 0
+    while start < len(order):
+        end = start + 1
+        # sorted by length, so the last text of a batch is its longest
+        while end < len(order) and end - start < batch_size and (end - start + 1) * len(texts[order[end]]) <= char_budget:
+            end += 1
+        batch = [texts[i] for i in order[start:end]]
+        for i, vector in zip(order[start:end], model.encode(batch, batch_size=len(batch), convert_to_numpy=True)):
+            vectors[i] = vector
+        start = end
+    if not vectors:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    return np.vstack(vectors).astype(np.float32, copy=False)
+
+
+class ModelRegistry:
+    """Loads every model once per worker process and hands out the shared instance.
+
+    Instances are shared by all jobs of the process, callers must only run inference with them.
+    """
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def register(self, name, loader):
+        with self._lock:
+            self._loaders[name] = loader
+
+    def get(self, name):
+        with self._lock:
+            if name in self._models:
+                return self._models[name]
+            if name not in self._loaders:
+                raise KeyError('model {} is not registered'.format(name))
+            # a second caller waits for the first load instead of loading again
+            load_lock = self._loading.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if name in self._models:
+                    return self._models[name]
+            rss = _rss_bytes()
+            start = time.perf_counter()
+            model = self._loaders[name](name)
+            load_seconds = time.perf_counter() - start
+            rss_after = _rss_bytes()
+            parameters = _parameter_bytes(model)
+            with self._lock:
+                self._models[name] = model
+                self._stats[name] = {'load_seconds': round(load_seconds, 3),
+                                     'rss_mb': None if rss is None or rss_after is None else round((rss_after - rss) / 2 ** 20, 1),
+                                     'parameter_mb': None if parameters is None else round(parameters / 2 ** 20, 1)}
+            print('model loaded', name, self._stats[name])
+            return model
+
+    def preload(self, names=None):
+        for name in PRELOAD_MODELS if names is None else names:
+            self.get(name)
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stat) for name, stat in self._stats.items()}
+
+
+model_registry = ModelRegistry()
+model_registry.register(EMBEDDING_MODEL, _load_sentence_transformer)
+model_registry.register(EMBEDDING_MODEL + ':int8', _load_int8_sentence_transformer)
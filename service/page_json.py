@@ -0,0 +1,79 @@
+import html as html_lib
+import json
+import re
+
+from bs4 import BeautifulSoup as bs
+
+
+# product pages start their body with <script>window.__PRELOADED_STATE__={...}</script>
+PRELOADED_STATE_MARKER = 'window.__PRELOADED_STATE__='
+PRELOADED_STATE_PREFIX_LEN = len(PRELOADED_STATE_MARKER)
+
+_graph_data_re = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)\b[^>]*\bid\s*=\s*["\']?graph_data\b[^>]*>')
+# contents of these tags are not entity-decoded by the html parser
+_raw_text_tags = {'script', 'style'}
+
+
+def _scan_product_script(html: str):
+    marker_idx = html.find(PRELOADED_STATE_MARKER)
+    if marker_idx == -1:
+        return None
+    # the marker has to be the very start of a <script> body
+    open_end = html.rfind('>', 0, marker_idx)
+    open_start = html.rfind('<', 0, open_end)
+    if open_end == -1 or open_start == -1 or html[open_end + 1:marker_idx].strip() \
+            or not html[open_start + 1:open_start + 7].lower() == 'script':
+        return None
+    close_idx = html.find('</script', marker_idx)
+    if close_idx == -1:
+        return None
+    return html[marker_idx:close_idx]
+
+
+def _scan_graph_data(html: str):
+    match = _graph_data_re.search(html)
+    if match is None:
+        return None
+    tag = match.group(1).lower()
+    close_idx = html.find('</' + match.group(1), match.end())
+    if close_idx == -1:
+        return None
+    text = html[match.end():close_idx]
+    if tag in _raw_text_tags:
+        return text
+    if '<' in text:
+        # nested markup, leave it to the html parser
+        return None
+    return html_lib.unescape(text)
+
+
+def extract_product_json(html: str):
+    """Returns the product state json of a smartstore/brand product page, or None if it has none."""
+    text = _scan_product_script(html)
+    if text is not None:
+        try:
+            return json.loads(text[PRELOADED_STATE_PREFIX_LEN:])
+        except ValueError:
+            pass
+
+    soup = bs(html, 'html.parser')
+    json_element = soup.select_one('body > script')
+    if json_element is None:
+        return None
+    return json.loads(json_element.get_text()[PRELOADED_STATE_PREFIX_LEN:])
+
+
+def extract_graph_data(html: str):
+    """Returns the json in #graph_data of a datalab trendResult page, or None if it has none."""
+    text = _scan_graph_data(html)
+    if text is not None:
+        try:
+            return json.loads(text[1:-1])
+        except ValueError:
+            pass
+
+    soup = bs(html, 'html.parser')
+    graph_element = soup.select_one('#graph_data')
+    if graph_element is None:
+        return None
+    return json.loads(graph_element.get_text()[1:-1])
@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from service.custom_error import NotValidKeywordError, NotSupportedUrlError
+from service.header_info import review_cookies, review_headers
+from service.http_client import http_client
+from service.page_json import extract_product_json
+
+
+origin_li = ['https://smartstore.naver.com', 'https://brand.naver.com']
+host_li = ['smartstore.naver.com', 'brand.naver.com']
+
+PRODUCT_META_TTL = float(os.environ.get('PRODUCT_META_TTL', 600))
+PRODUCT_META_CACHE_SIZE = int(os.environ.get('PRODUCT_META_CACHE_SIZE', 256))
+
+
+@dataclass(frozen=True)
+class ProductMeta:
+    url: str
+    api_idx: int
+    merchant_no: int
+    product_no: int
+    category_id: Optional[str]
+    category_ids: Tuple[str, ...]
+    category_list: List[str]
+    product_name: str
+    review_cnt: int
+    brand_name: Optional[str] = None
+    model_name: Optional[str] = None
+    word_list: List[str] = field(default_factory=list)
+    img_url: Optional[str] = None
+
+    def basic_info(self):
+        return {'product_name': self.product_name,
+                'category_list': self.category_list,
+                'review_cnt': self.review_cnt,
+                'brand_name': self.brand_name,
+                'model_name': self.model_name,
+                'word_list': self.word_list,
+                'img_url': self.img_url}
+
+
+def normalize_url(url: str):
+    # tracking parameters (NaPm, ...) and fragments do not change the product page
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip('/')
+    return urlunsplit(('https', parts.netloc.lower(), path, '', ''))
+
+
+def get_api_idx(url: str):
+    host = urlsplit(url).netloc.lower()
+    if host not in host_li:
+        raise NotSupportedUrlError()
+    return host_li.index(host)
+
+
+def product_headers(url: str, api_idx: int):
+    headers = review_headers.copy()
+    headers['referer'] = url
+    headers['origin'] = origin_li[api_idx]
+    return headers
+
+
+def parse_product_meta(url: str, api_idx: int, html: str):
+    try:
+        item_json = extract_product_json(html)
+    except ValueError:
+        item_json = None
+    if item_json is None:
+        raise NotValidKeywordError('Keyword for get reviews is not valid.')
+
+    # merchantNo: categoryTree > product > A > channel > naverPaySellerNo
+    try:
+        product = item_json['product']['A']
+        merchant_no = product['channel']['naverPaySellerNo']
+        product_no = product['productNo']
+        product_name = product['name']
+    except (KeyError, TypeError):
+        raise NotValidKeywordError('Product information is not found in the page.')
+    category = product.get('category') or {}
+    search_info = product.get('naverShoppingSearchInfo') or {}
+    images = product.get('productImages') or [{}]
+    return ProductMeta(url=url,
+                       api_idx=api_idx,
+                       merchant_no=merchant_no,
+                       product_no=product_no,
+                       category_id=category.get('category1Id'),
+                       category_ids=tuple(category[key] for key in ('category1Id', 'category2Id', 'category3Id', 'category4Id')
+                                          if category.get(key) is not None),
+                       category_list=(category.get('wholeCategoryName') or '').split('>'),
+                       product_name=product_name,
+                       review_cnt=(product.get('reviewAmount') or {}).get('totalReviewCount', 0),
+                       brand_name=search_info.get('brandName'),
+                       model_name=search_info.get('modelName'),
+                       word_list=[item['text'] for item in (product.get('seoInfo') or {}).get('sellerTags') or []],
+                       img_url=images[0].get('url'))
+
+
+def fetch_product_meta(url: str):
+    api_idx = get_api_idx(url)
+    res = http_client.get(url, cookies=review_cookies, headers=product_headers(url, api_idx))
+    return parse_product_meta(url, api_idx, res.text)
+
+
+class ProductMetaService:
+    """Product page metadata keyed by normalized url.
+
+    Entries live for ``ttl`` seconds and at most ``max_size`` of them are kept (least recently used
+    go first). Concurrent lookups of a url that is being fetched wait for that fetch instead of
+    downloading the page again.
+    """
+    def __init__(self, fetcher=fetch_product_meta, ttl=PRODUCT_META_TTL, max_size=PRODUCT_META_CACHE_SIZE):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str):
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                expires_at, meta = entry
+                if expires_at > time.monotonic():
+                    self._cache.move_to_end(key)
+                    return meta
+                del self._cache[key]
+
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            meta = self.fetcher(key)
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, meta)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+            self._inflight.pop(key, None)
+        future.set_result(meta)
+        return meta
+
+    def invalidate(self, url: str = None):
+        with self._lock:
+            if url is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(normalize_url(url), None)
+
+
+product_meta_service = ProductMetaService()
+
+
+def get_product_meta(url: str):
+    return product_meta_service.get(url)
@@ -0,0 +1,148 @@
+import glob
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from service.crawl_checkpoint import parse_review_time
+
+
+STORE_DIR = 'csv/store'
+REVIEW_TZ = 'Asia/Seoul'
+# rows buffered before a part file (one row group) is written
+ROW_GROUP_SIZE = int(os.environ.get('REVIEW_ROW_GROUP_SIZE', 2000))
+# rows per chunk when reviews are streamed
+READ_CHUNK_SIZE = int(os.environ.get('REVIEW_READ_CHUNK_SIZE', 5000))
+
+REVIEW_SCHEMA = pa.schema([
+    ('review_id', pa.int64()),
+    ('userid', pa.string()),
+    ('content', pa.string()),
+    ('star_rating', pa.int8()),
+    ('time', pa.timestamp('ms', tz=REVIEW_TZ)),
+])
+REVIEW_COLUMNS = REVIEW_SCHEMA.names
+
+
+def review_row(item):
+    return {'review_id': item.get('id'),
+            'userid': item['writerId'],
+            'content': item['reviewContent'],
+            'star_rating': int(item['reviewScore']),
+            'time': parse_review_time(item['createDate'])}
+
+
+class ReviewStore:
+    """Reviews of one product as parquet part files under ``csv/store/<merchantNo>_<productNo>/``.
+
+    ``append`` buffers rows and writes a closed part file every ``row_group_size`` rows, so what
+    is on disk is always readable even if the crawl dies. ``compact`` merges the parts into one file.
+    """
+    def __init__(self, merchant_no, product_no, root=STORE_DIR, row_group_size=ROW_GROUP_SIZE):
+        self.path = os.path.join(root, '{}_{}'.format(merchant_no, product_no))
+        self.row_group_size = row_group_size
+        self._buffer = []
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def _next_part_path(self):
+        parts = self._parts()
+        next_idx = int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0
+        return os.path.join(self.path, 'part-{:05d}.parquet'.format(next_idx))
+
+    def exists(self):
+        return len(self._parts()) > 0
+
+    def reset(self):
+        self._buffer = []
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def append(self, rows):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        if not self._buffer:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        part_path = self._next_part_path()
+        table = pa.Table.from_pylist(self._buffer, schema=REVIEW_SCHEMA)
+        pq.write_table(table, part_path + '.tmp', row_group_size=len(self._buffer))
+        os.replace(part_path + '.tmp', part_path)
+        self._buffer = []
+
+    def compact(self):
+        self.flush()
+        parts = self._parts()
+        if len(parts) <= 1:
+            return
+        table = ds.dataset(parts, schema=REVIEW_SCHEMA, format='parquet').to_table()
+        # the merged part is in place before the old ones go away
+        part_path = self._next_part_path()
+        pq.write_table(table, part_path + '.tmp', row_group_size=self.row_group_size)
+        os.replace(part_path + '.tmp', part_path)
+        for part in parts:
+            os.remove(part)
+
+    def snapshot(self, path):
+        """Writes the whole store to one parquet file, e.g. the review file of an analysis job."""
+        self.compact()
+        parts = self._parts()
+        if parts:
+            shutil.copyfile(parts[0], path)
+        else:
+            pq.write_table(REVIEW_SCHEMA.empty_table(), path)
+        return path
+
+
+def review_file(filename: str):
+    # jobs are still named csv/reviews_<time>.csv, their reviews live next to it as parquet
+    return os.path.splitext(filename)[0] + '.parquet'
+
+
+def _star_filter(star_rating_range):
+    if star_rating_range is None:
+        return None
+    return (ds.field('star_rating') >= star_rating_range[0]) & (ds.field('star_rating') <= star_rating_range[1])
+
+
+def _dataset(path):
+    return ds.dataset(path, schema=REVIEW_SCHEMA, format='parquet')
+
+
+def read_reviews(path: str, columns=None, star_rating_range=None):
+    """Loads reviews as a DataFrame, only the given columns and star ratings are read."""
+    if path.endswith('.csv'):
+        df = pd.read_csv(path, usecols=columns)
+        if star_rating_range is not None:
+            df = df[(df['star_rating'] >= star_rating_range[0]) & (df['star_rating'] <= star_rating_range[1])]
+        return df
+    return _dataset(path).to_table(columns=columns, filter=_star_filter(star_rating_range)).to_pandas()
+
+
+def iter_reviews(path: str, columns=None, star_rating_range=None, chunk_size=READ_CHUNK_SIZE):
+    """Same as read_reviews but yields DataFrames of at most chunk_size rows."""
+    if path.endswith('.csv'):
+        for df in pd.read_csv(path, usecols=columns, chunksize=chunk_size):
+            if star_rating_range is not None:
+                df = df[(df['star_rating'] >= star_rating_range[0]) & (df['star_rating'] <= star_rating_range[1])]
+            yield df
+        return
+    batches = _dataset(path).to_batches(columns=columns, filter=_star_filter(star_rating_range), batch_size=chunk_size)
+    for batch in batches:
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def export_csv(path: str, csv_path: str):
+    df = read_reviews(path, columns=['userid', 'content', 'star_rating', 'time'])
+    df['time'] = df['time'].map(lambda t: t.isoformat(timespec='milliseconds'))
+    df.to_csv(csv_path, index=False, encoding='utf-8')
+    return csv_path
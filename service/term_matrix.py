@@ -0,0 +1,87 @@
+import itertools
+
+import numpy as np
+import scipy.sparse as sp
+
+
+# words kept in the shared vocabulary, the most frequent ones
+MAX_FEATURES = 3000
+
+
+class TermMatrixBuilder:
+    """Collects the token ids of preprocessed documents chunk by chunk.
+
+    Tokens are lowercased like CountVectorizer does. ``build`` turns them into a CSR document-term
+    matrix over the max_features most frequent words.
+    """
+    def __init__(self):
+        self.vocabulary = {}
+        self._indices = []
+        self._lengths = []
+
+    def __len__(self):
+        return sum(len(lengths) for lengths in self._lengths)
+
+    def add(self, token_lists):
+        vocabulary = self.vocabulary
+        flat = itertools.chain.from_iterable(token_lists)
+        lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+        self._indices.append(np.fromiter((vocabulary.setdefault(t.lower(), len(vocabulary)) for t in flat),
+                                         dtype=np.int64, count=int(lengths.sum())))
+        self._lengths.append(lengths)
+
+    def build(self, max_features=MAX_FEATURES):
+        """Returns the (documents x words) count matrix and its words, sorted like CountVectorizer's features."""
+        lengths = np.concatenate(self._lengths) if self._lengths else np.zeros(0, dtype=np.int64)
+        indices = np.concatenate(self._indices) if self._indices else np.zeros(0, dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        words = list(self.vocabulary)
+        X = sp.csr_matrix((np.ones(len(indices), dtype=np.int64), indices, indptr), shape=(len(lengths), len(words)))
+        X.sum_duplicates()
+
+        counts = np.asarray(X.sum(axis=0)).ravel()
+        keep = range(len(words))
+        if max_features is not None and len(words) > max_features:
+            # most frequent first, ties by word
+            keep = sorted(keep, key=lambda i: (-counts[i], words[i]))[:max_features]
+        keep = sorted(keep, key=words.__getitem__)
+        return X[:, keep].tocsr(), np.array([words[i] for i in keep], dtype=object)
+
+
+class TermMatrixVectorizer:
+    """CountVectorizer stand-in over a pre-built document-term matrix.
+
+    ``transform`` looks documents up by their text, documents with the same tokens have the same row.
+    Only texts it wasn't built with, like the joined topic documents of BERTopic's update_topics, are split.
+    """
+    def __init__(self, matrix, words, documents):
+        self.matrix = matrix.tocsr()
+        self.words = np.asarray(words, dtype=object)
+        self.vocabulary_ = {w: i for i, w in enumerate(self.words)}
+        self.rows = {document: i for i, document in enumerate(documents)}
+
+    def fit(self, documents, y=None):
+        return self
+
+    def fit_transform(self, documents, y=None):
+        return self.transform(documents)
+
+    def transform(self, documents):
+        rows = [self.rows.get(document, -1) for document in documents]
+        if -1 not in rows:
+            return self.matrix[rows]
+        X = sp.lil_matrix((len(rows), len(self.words)), dtype=np.int64)
+        for i, (row, document) in enumerate(zip(rows, documents)):
+            if row >= 0:
+                X[i] = self.matrix[row]
+                continue
+            for word in document.lower().split():
+                if word in self.vocabulary_:
+                    X[i, self.vocabulary_[word]] += 1
+        return X.tocsr()
+
+    def get_feature_names_out(self):
+        return self.words
+
+    def build_tokenizer(self):
+        return str.split
@@ -1,75 +1,184 @@
-from datetime import datetime
-from kiwipiepy import Kiwi
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from kiwipiepy import Kiwi, __version__ as kiwi_version
 from kiwipiepy.utils import Stopwords
 
+from service.crawl_checkpoint import REVIEW_TIME_FORMAT
+from service.token_cache import token_cache, config_digest, normalize_text
+
+
+DEFAULT_POS_LIST = ['NNG', 'NNP', 'VV', 'VA']
+# threads kiwi uses for batched tokenization, 0 = all cores
+KIWI_WORKERS = int(os.environ.get('KIWI_WORKERS', 0))
+
+_kiwi = {}
+_kiwi_lock = threading.Lock()
+_default_stopwords = None
+
+
+def get_kiwi(num_workers=None):
+    """Process-wide Kiwi analyzer, loading the model takes seconds so it is built once per worker count."""
+    num_workers = KIWI_WORKERS if num_workers is None else num_workers
+    with _kiwi_lock:
+        if num_workers not in _kiwi:
+            _kiwi[num_workers] = Kiwi(num_workers=num_workers, typos='basic')
+        return _kiwi[num_workers]
+
+
+def parse_times(times):
+    """Parses a review time column in one pass, review stores give datetime64 already, legacy csv files give strings."""
+    if pd.api.types.is_datetime64_any_dtype(times):
+        return times
+    return pd.to_datetime(times, format=REVIEW_TIME_FORMAT)
+
+
+def month_index(times):
+    # year * 12 + month - 1 in the reviews' own timezone
+    return (times.dt.year * 12 + times.dt.month - 1).astype('int32')
+
+
+def month_label(index):
+    return '{}. {}.'.format(index // 12, index % 12 + 1)
+
+
+def default_stopwords():
+    global _default_stopwords
+    if _default_stopwords is None:
+        _default_stopwords = [w for w, t in Stopwords().stopwords]
+    return list(_default_stopwords)
+
 
 class TextPreprocessing:
-    def __init__(self, stopwords=None):
+    def __init__(self, stopwords=None, num_workers=None, use_cache=True):
         if stopwords is not None:
             if type(stopwords) is not list:
                 raise "The type of custom stopwords should be list"
             self.stopwords = stopwords
         else:
-            self.stopwords = [w for w, t in Stopwords().stopwords]
+            self.stopwords = default_stopwords()
+        self.num_workers = num_workers
+        self.use_cache = use_cache
         self.documents = []
         self.timestamps = []
         self.original_doc = []
         self.star_rating_list = []
-        self.kiwi = Kiwi(typos='basic')
+
+    @property
+    def kiwi(self):
+        return get_kiwi(self.num_workers)
 
     def add_stopwords(self, word):
         if type(word) is not str:
             raise "Word should be string."
         self.stopwords.append(word)
 
-    def proprocess_text(self, df, product_name=None, star_rating_range=None, pos_list=None):
-        # df should have 'content' column.
-        if pos_list is None:
-            pos_list = ['NNG', 'NNP', 'VV', 'VA']
-
-        def _get_content(row):
-            x = row['content']
-            time = row['time']
-            sr = row['star_rating']
-            # sent_tokens = self.kiwi.split_into_sents(x, return_tokens=True)
-            # for s in sent_tokens:
-            result = []
-            word_tokens = self.kiwi.tokenize(x)
-            # print(word_tokens)
-            for word in word_tokens:
-                w = word[0]
-                p = word[1]
-                if len(w) <= 1 or w in self.stopwords:
-                    continue
-                if p in pos_list:
-                    result.append(w)
-            if len(result) > 1:
-                self.documents.append(' '.join(result))
-                self.timestamps.append(datetime.strptime(time, '%Y-%m-%dT%H:%M:%S.%f%z'))
-                self.original_doc.append(x)
-                self.star_rating_list.append(sr)
+    def tokenize_batch(self, texts, pos_list=None):
+        """Tokenizes all texts in one kiwi batch, returns the kept words of every text.
+
+        Texts already in the token cache, or repeated in the batch, are not tokenized again.
+        """
+        pos_set = frozenset(DEFAULT_POS_LIST if pos_list is None else pos_list)
+        stopword_set = frozenset(self.stopwords)
+        digest = config_digest(kiwi_version, pos_set, stopword_set)
+        texts = [normalize_text(t) for t in texts]
+        keys = [token_cache.key(digest, t) for t in texts]
+        tokens = token_cache.get_many(keys) if self.use_cache else {}
+
+        todo = {}
+        for key, text in zip(keys, texts):
+            if key not in tokens:
+                todo[key] = text
+        new_tokens = []
+        for key, word_tokens in zip(todo, self.kiwi.tokenize(list(todo.values()))):
+            tokens[key] = [t.form for t in word_tokens
+                           if t.tag in pos_set and len(t.form) > 1 and t.form not in stopword_set]
+            new_tokens.append((key, tokens[key]))
+        if self.use_cache:
+            token_cache.set_many(new_tokens)
+        return [tokens[key] for key in keys]
 
+    def preprocess_batch(self, df, star_rating_range=None, pos_list=None, terms=None):
+        """Preprocesses a review DataFrame ('content', 'time', 'star_rating') in one pass.
+
+        Returns a DataFrame with 'document' (space joined tokens), 'time', 'month' (see month_index),
+        'content' and 'star_rating' of the reviews that kept more than one word and are not only numbers.
+        The tokens of the kept reviews are added to terms, a TermMatrixBuilder, when given.
+        """
         if star_rating_range is not None:
             df = df[(df['star_rating'] >= star_rating_range[0]) & (df['star_rating'] <= star_rating_range[1])]
-        df.apply(_get_content, axis=1)
-
-        pp_timestamps = []
-        pp_original_doc = []
-        preprocessed_documents = []
-        for l in range(len(self.documents)):
-            line = self.documents[l]
-            if line and not line.replace(' ', '').isdecimal():
-                preprocessed_documents.append(line)
-                pp_timestamps.append(self.timestamps[l])
-                pp_original_doc.append(self.original_doc[l])
-
-        self.documents = preprocessed_documents
-        self.timestamps = pp_timestamps
-        self.original_doc = pp_original_doc
+        tokens = self.tokenize_batch(df['content'].tolist(), pos_list)
+        documents = [' '.join(words) for words in tokens]
+        keep = np.array([d.count(' ') > 0 and not d.replace(' ', '').isdecimal() for d in documents], dtype=bool)
+        if terms is not None:
+            terms.add([words for words, k in zip(tokens, keep) if k])
+
+        kept = df[keep]
+        times = parse_times(kept['time']).reset_index(drop=True)
+        return pd.DataFrame({'document': [d for d, k in zip(documents, keep) if k],
+                             'time': times,
+                             'month': month_index(times),
+                             'content': kept['content'].tolist(),
+                             'star_rating': kept['star_rating'].tolist()})
+
+    def iter_preprocess(self, chunks, star_rating_range=None, pos_list=None, terms=None):
+        """read -> tokenize -> filter pipeline over review DataFrame chunks, yields the kept rows of each chunk."""
+        for chunk in chunks:
+            result = self.preprocess_batch(chunk, star_rating_range=star_rating_range, pos_list=pos_list, terms=terms)
+            if len(result):
+                yield result
+
+    def proprocess_text(self, df, product_name=None, star_rating_range=None, pos_list=None):
+        # df should have 'content' column.
+        result = self.preprocess_batch(df, star_rating_range=star_rating_range, pos_list=pos_list)
+        self.documents = result['document'].tolist()
+        self.timestamps = result['time'].tolist()
+        self.original_doc = result['content'].tolist()
+        self.star_rating_list = result['star_rating'].tolist()
         # print(product_name, preprocessed_documents[:5])
         print('''Preprocessing is done, You can access to preprocessed data with ".documents"''')
 
 
+def _arrow_strings(arrow_type):
+    # keep strings in arrow buffers instead of one python object per row
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+class PreprocessedBuffer:
+    """Collects preprocessed chunks as arrow columns.
+
+    Strings live in contiguous arrow buffers and star ratings as int8, so a large corpus costs
+    about its text size instead of a python object per row and column.
+    """
+    def __init__(self):
+        self._tables = []
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def append(self, df):
+        table = pa.table({'document': pa.array(df['document'].tolist(), pa.string()),
+                          'time': pa.array(df['time']),
+                          'month': pa.array(df['month'], pa.int32()),
+                          'content': pa.array(df['content'].tolist(), pa.string()),
+                          'star_rating': pa.array(df['star_rating'].tolist(), pa.int8())})
+        if self._tables:
+            table = table.cast(self._tables[0].schema)
+        self._tables.append(table)
+        self._rows += len(table)
+
+    def to_pandas(self):
+        if not self._tables:
+            return pd.DataFrame({'document': [], 'time': [], 'month': [], 'content': [], 'star_rating': []})
+        return pa.concat_tables(self._tables).to_pandas(types_mapper=_arrow_strings)
+
+
 class SimpleTokenizerForBERTopic:
     def __call__(self, sent):
         # sent = sent[:1000000]
@@ -79,4 +188,4 @@ class SimpleTokenizerForBERTopic:
             if len(w) >= 1:
                 result.append(w)
 
-        return result
\ No newline at end of file
+        return result
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+
+TOKEN_CACHE_PATH = os.environ.get('TOKEN_CACHE_PATH', 'cache/token_cache.sqlite')
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', 1000000))
+# sqlite limits the number of bound variables per statement
+_CHUNK = 500
+
+
+def normalize_text(text: str):
+    # spacing and unicode composition differences don't change what a review says
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def config_digest(version, pos_list, stopwords):
+    """Identifies the tokenizer setup, entries of another kiwi version, POS list or stopword set never match."""
+    config = json.dumps([version, sorted(pos_list), sorted(stopwords)], ensure_ascii=False)
+    return hashlib.sha1(config.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """Filtered kiwi tokens of review texts in a sqlite file, shared by every job and product.
+
+    Keys are sha1(config digest + normalized text). When the table grows past ``max_entries``
+    the least recently used tenth is dropped.
+    """
+    def __init__(self, path=TOKEN_CACHE_PATH, max_entries=TOKEN_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._ready = False
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _transaction(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._ready:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, tokens TEXT NOT NULL, used REAL NOT NULL)')
+                conn.execute('CREATE INDEX IF NOT EXISTS tokens_used ON tokens (used)')
+                self._ready = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def key(digest, normalized_text):
+        return hashlib.sha1((digest + normalized_text).encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """Returns {key: tokens} of the cached keys."""
+        found = {}
+        unique = list(set(keys))
+        try:
+            with self._lock, self._transaction() as conn:
+                for i in range(0, len(unique), _CHUNK):
+                    chunk = unique[i:i + _CHUNK]
+                    rows = conn.execute('SELECT key, tokens FROM tokens WHERE key IN ({})'.format(','.join('?' * len(chunk))),
+                                        chunk).fetchall()
+                    found.update((key, json.loads(tokens)) for key, tokens in rows)
+                now = time.time()
+                conn.executemany('UPDATE tokens SET used = ? WHERE key = ?', [(now, key) for key in found])
+        except sqlite3.Error as e:
+            print('token cache read error', e)
+        hits = sum(1 for key in keys if key in found)
+        # the cache is shared by the threads of the app
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def set_many(self, items):
+        """Stores (key, tokens) pairs and evicts the least recently used entries above max_entries."""
+        if not items:
+            return
+        now = time.time()
+        try:
+            with self._lock, self._transaction() as conn:
+                conn.executemany('INSERT OR REPLACE INTO tokens (key, tokens, used) VALUES (?, ?, ?)',
+                                 [(key, json.dumps(tokens, ensure_ascii=False), now) for key, tokens in items])
+                count = conn.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+                if count > self.max_entries:
+                    evict = count - self.max_entries + self.max_entries // 10
+                    conn.execute('DELETE FROM tokens WHERE key IN (SELECT key FROM tokens ORDER BY used LIMIT ?)', (evict,))
+        except sqlite3.Error as e:
+            print('token cache write error', e)
+
+    def hit_rate(self):
+        with self._lock:
+            hits, total = self.hits, self.hits + self.misses
+        return hits / total if total else 0.0
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total if total else 0.0, 4)}
+
+    def clear(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self._ready = False
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(self.path + suffix)
+                except OSError:
+                    pass
+
+
+token_cache = TokenCache()
@@ -0,0 +1,137 @@
+import numpy as np
+
+from service.model_registry import encode_length_bucketed
+from service.review_store import iter_reviews, READ_CHUNK_SIZE
+from service.term_matrix import TermMatrixBuilder
+from service.text_preprocessing import TextPreprocessing, PreprocessedBuffer, month_label
+from service.token_cache import token_cache
+
+# raw reviews kept for the summary input
+HEAD_SIZE = 10
+
+
+class TokenizedCorpus:
+    """Preprocessed reviews of one analysis job.
+
+    Reviews are read and tokenized once; the pros, cons and DTM stages take star-rating views of it.
+    ``data`` has one row per kept review: document, time, month (year * 12 + month - 1), content and star_rating.
+    ``head`` is the content of the first reviews as read, kept or not.
+    ``embeddings`` is the float32 (rows x dim) document embedding matrix once ``embed`` ran.
+    ``terms`` is the (rows x words) CSR count matrix over the shared vocabulary ``words``.
+    """
+    def __init__(self, data, head, embeddings=None, terms=None, words=None):
+        self.data = data.reset_index(drop=True)
+        self.head = head
+        self.embeddings = embeddings
+        if terms is None:
+            builder = TermMatrixBuilder()
+            builder.add([document.split() for document in self.data['document']])
+            terms, words = builder.build()
+        self.terms = terms
+        self.words = words
+        # star rating -> row positions in data, view selects by it
+        self.star_index = {int(star): rows for star, rows in self.data.groupby('star_rating').indices.items()}
+
+    @classmethod
+    def from_reviews(cls, path, text_pp=None, chunk_size=READ_CHUNK_SIZE):
+        """Streams the reviews through preprocessing chunk by chunk, only kept rows are buffered."""
+        text_pp = TextPreprocessing() if text_pp is None else text_pp
+        head = []
+
+        def chunks():
+            for chunk in iter_reviews(path, columns=['content', 'star_rating', 'time'], chunk_size=chunk_size):
+                if len(head) < HEAD_SIZE:
+                    head.extend(chunk['content'][:HEAD_SIZE - len(head)].tolist())
+                yield chunk
+
+        buffer = PreprocessedBuffer()
+        terms = TermMatrixBuilder()
+        cache_before = token_cache.stats()
+        for result in text_pp.iter_preprocess(chunks(), terms=terms):
+            buffer.append(result)
+        if text_pp.use_cache:
+            # the cache is shared by the process, report this job's lookups only
+            cache_after = token_cache.stats()
+            hits = cache_after['hits'] - cache_before['hits']
+            misses = cache_after['misses'] - cache_before['misses']
+            print('token cache', {'hits': hits, 'misses': misses,
+                                  'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0})
+        return cls(buffer.to_pandas(), head, None, *terms.build())
+
+    def view(self, star_rating_range=None):
+        if star_rating_range is None:
+            return self
+        low, high = star_rating_range
+        rows = [idx for star, idx in self.star_index.items() if low <= star <= high]
+        rows = np.sort(np.concatenate(rows)) if rows else np.array([], dtype=int)
+        embeddings = None if self.embeddings is None else self.embeddings[rows]
+        # words the view doesn't use would get an infinite idf
+        terms = self.terms[rows]
+        present = np.flatnonzero(terms.getnnz(axis=0))
+        return TokenizedCorpus(self.data.iloc[rows], self.head, embeddings, terms[:, present], self.words[present])
+
+    def sample_rows(self, size, seed=42):
+        """Row positions of a sample of about size rows stratified by star rating and month.
+
+        Every (star rating, month) stratum gets its share of the sample, at least one row, so the
+        topics fitted on it see every month and rating. Returns sorted positions.
+        """
+        if size >= len(self):
+            return np.arange(len(self))
+        strata = list(self.data.groupby(['star_rating', 'month'], sort=True).indices.values())
+        sizes = np.array([len(rows) for rows in strata])
+        share = size * sizes / sizes.sum()
+        quota = np.minimum(np.maximum(np.floor(share).astype(int), 1), sizes)
+        # the rows floor() left over go to the largest remainders
+        for i in np.argsort(share - np.floor(share))[::-1]:
+            if quota.sum() >= size:
+                break
+            if quota[i] < sizes[i]:
+                quota[i] += 1
+        rng = np.random.default_rng(seed)
+        rows = [rng.choice(stratum, n, replace=False) for stratum, n in zip(strata, quota)]
+        return np.sort(np.concatenate(rows))
+
+    def embed(self, model, batch_size=32):
+        """Encodes every distinct document once with a SentenceTransformer model."""
+        if self.embeddings is not None:
+            return self.embeddings
+        documents = self.documents
+        distinct = list(dict.fromkeys(documents))
+        vectors = encode_length_bucketed(model, distinct, batch_size=batch_size)
+        position = {document: i for i, document in enumerate(distinct)}
+        self.embeddings = vectors[np.array([position[d] for d in documents], dtype=np.int64)]
+        return self.embeddings
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def documents(self):
+        return self.data['document'].tolist()
+
+    @property
+    def timestamps(self):
+        return self.data['time'].tolist()
+
+    @property
+    def original_doc(self):
+        return self.data['content'].tolist()
+
+    @property
+    def star_rating_list(self):
+        return self.data['star_rating'].tolist()
+
+    @property
+    def month_indices(self):
+        return self.data['month'].to_numpy()
+
+    @property
+    def months(self):
+        """'{year}. {month}.' label of every row."""
+        indices = self.month_indices
+        if len(indices) == 0:
+            return []
+        first = indices.min()
+        labels = np.array([month_label(m) for m in range(first, indices.max() + 1)], dtype=object)
+        return labels[indices - first].tolist()
@@ -0,0 +1,212 @@
+import atexit
+import gc
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import pyarrow as pa
+import scipy.sparse as sp
+from threadpoolctl import threadpool_limits
+
+from service.feature_extraction import FeatureExtraction, EMBEDDING_BATCH_SIZE
+from service.text_preprocessing import _arrow_strings
+from service.tokenized_corpus import TokenizedCorpus
+
+
+# processes running the pros, cons and DTM topic models of a job at once, 0 = one after another in the job's process.
+# every worker loads its own copy of the embedding model, see the README
+TOPIC_WORKERS = int(os.environ.get('TOPIC_WORKERS', 0))
+# BLAS / OpenMP / torch / numba threads of each worker, 0 = the cores split between the workers
+TOPIC_WORKER_THREADS = int(os.environ.get('TOPIC_WORKER_THREADS', 0))
+
+# stage -> star rating range of its reviews, the largest stage first so it starts first
+STAGES = {'dtm': None, 'pros': [5, 5], 'cons': [1, 3]}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class SharedCorpus:
+    """A TokenizedCorpus in shared memory blocks, workers map it instead of unpickling a copy each.
+
+    The rows are an arrow IPC stream, the embeddings and the term matrix raw numpy buffers.
+    ``handle`` is the small picklable description workers attach with.
+    """
+    def __init__(self, corpus):
+        self._blocks = []
+        table = pa.Table.from_pandas(corpus.data, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        terms = corpus.terms.tocsr()
+        self.handle = {'head': corpus.head,
+                       'words': corpus.words.tolist(),
+                       'terms_shape': terms.shape,
+                       'data': self._share(np.frombuffer(sink.getvalue(), dtype=np.uint8)),
+                       'embeddings': self._share(corpus.embeddings),
+                       'terms': [self._share(a) for a in (terms.data, terms.indices, terms.indptr)]}
+
+    def _share(self, array):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._blocks.append(block)
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        return block.name, array.shape, array.dtype.str
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def attach_corpus(handle):
+    """Maps a SharedCorpus handle, returns the corpus and the blocks to close once it is dropped.
+
+    The rows are read from a copy of their block, which is closed right away: arrow and pandas keep views
+    of the buffer they read that can outlive the corpus. The embeddings and the term matrix stay mapped.
+    """
+    blocks = []
+
+    def array(spec):
+        name, shape, dtype = spec
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        return np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+    stream = array(handle['data']).copy()
+    blocks.pop().close()
+    data = pa.ipc.open_stream(pa.py_buffer(stream)).read_all().to_pandas(types_mapper=_arrow_strings)
+    terms = sp.csr_matrix(tuple(array(spec) for spec in handle['terms']), shape=handle['terms_shape'], copy=False)
+    corpus = TokenizedCorpus(data, handle['head'], array(handle['embeddings']), terms,
+                             np.array(handle['words'], dtype=object))
+    return corpus, blocks
+
+
+def run_stage(corpus, csv_path, product_name, stage):
+    """One topic stage on an embedded corpus.
+
+    pros / cons return get_topics_with_keyword's (topics, representative tokens), dtm returns
+    (head, original_doc, dtm records).
+    """
+    fe = FeatureExtraction(corpus=corpus, csv_path=csv_path)
+    if stage == 'dtm':
+        head, original_doc = fe.train_topic_model_with_bertopic(csv_path, product_name)
+        return head, original_doc, fe.get_topics_per_month().to_dict('records')
+    fe.train_topic_model_with_bertopic(csv_path, product_name, star_rating_range=STAGES[stage])
+    return fe.get_topics_with_keyword(top_n_word=10)
+
+
+def _init_worker(threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    try:
+        import numba
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+    except ImportError:
+        pass
+    # after the imports, threadpoolctl only limits libraries that are loaded.
+    # the embedding model is loaded by the first stage that embeds topic words (RegistryEmbedder)
+    threadpool_limits(threads)
+
+
+def get_pool(workers, threads):
+    """Process-wide pool of topic workers, they keep their imports and loaded models between jobs until shutdown_pools."""
+    with _pools_lock:
+        pool = _pools.get((workers, threads))
+        if pool is None or pool._broken:
+            # spawned workers don't inherit the threads and locks of the app process
+            pool = ProcessPoolExecutor(workers, mp_context=get_context('spawn'),
+                                       initializer=_init_worker, initargs=(threads,))
+            _pools[workers, threads] = pool
+        return pool
+
+
+def shutdown_pools():
+    """Stops the topic workers, registered with atexit and called when the app shuts down."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_pools)
+
+
+def _run_shared_stage(handle, csv_path, product_name, stage):
+    corpus, blocks = attach_corpus(handle)
+    try:
+        return run_stage(corpus, csv_path, product_name, stage)
+    finally:
+        # the blocks can only be closed once nothing maps them anymore
+        del corpus
+        gc.collect()
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                # still viewed by something of the stage, it stays mapped until the worker exits
+                print('shared memory block {} of stage {} is still in use, not closed'.format(block.name, stage))
+
+
+class TopicStages:
+    """Runs the pros, cons and DTM topic models of a job, in parallel worker processes when workers > 0.
+
+    The reviews are tokenized and embedded once here, then shared with the workers of get_pool.
+    ``futures`` maps every stage to the Future of its run_stage result; with workers=0 a stage runs in
+    this process when ``result`` first asks for it, so the caller decides the order.
+
+        with TopicStages(review_path, product_name) as stages:
+            pros_topics, pros_rep_token = stages.result('pros')
+    """
+    def __init__(self, csv_path, product_name, workers=TOPIC_WORKERS, threads=TOPIC_WORKER_THREADS):
+        self.csv_path = csv_path
+        self.product_name = product_name
+        self.workers = min(workers, len(STAGES))
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max(self.workers, 1))
+        self.futures = {}
+        self._shared = None
+        self._corpus = None
+
+    def __enter__(self):
+        fe = FeatureExtraction()
+        corpus = fe.load_corpus(self.csv_path)
+        corpus.embed(fe.get_embedding_model(), batch_size=EMBEDDING_BATCH_SIZE)
+        if not self.workers:
+            # a stage runs when its result is asked for, in the caller's order
+            self._corpus = corpus
+            self.futures = {stage: Future() for stage in STAGES}
+            return self
+
+        self._shared = SharedCorpus(corpus)
+        pool = get_pool(self.workers, self.threads)
+        for stage in STAGES:
+            self.futures[stage] = pool.submit(_run_shared_stage, self._shared.handle, self.csv_path,
+                                              self.product_name, stage)
+        return self
+
+    def result(self, stage):
+        future = self.futures[stage]
+        if self._corpus is not None and not future.done():
+            try:
+                future.set_result(run_stage(self._corpus, self.csv_path, self.product_name, stage))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def __exit__(self, exc_type, exc, tb):
+        # stages nobody asked for don't run
+        self._corpus = None
+        if self._shared is not None:
+            # the workers must be done with the blocks before they go away
+            for future in self.futures.values():
+                future.cancel()
+            wait(self.futures.values())
+            self._shared.close()
+        return False
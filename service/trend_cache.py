@@ -0,0 +1,100 @@
+import datetime
+import json
+import os
+import threading
+
+
+TREND_CACHE_PATH = os.environ.get('TREND_CACHE_PATH', 'cache/trend_cache.json')
+
+
+def current_week():
+    year, week, _ = datetime.date.today().isocalendar()
+    return '{}-W{:02d}'.format(year, week)
+
+
+class TrendCache:
+    """Datalab query hashes, date axes and trend series, persisted to a json file.
+
+    Keys are (kind, keyword, window) and only entries of the current ISO week are served,
+    older ones are dropped the next time the file is loaded or written.
+    """
+    def __init__(self, path=TREND_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._week = None
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(kind, keyword, window):
+        return '|'.join([kind, keyword] + [str(w) for w in window])
+
+    def _read(self, week):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                stored = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if stored.get('week') != week:
+            return {}
+        return stored.get('entries', {})
+
+    def _load(self):
+        week = current_week()
+        if self._week == week:
+            return
+        self._week = week
+        self._entries = self._read(week)
+
+    def _save(self):
+        # other workers may have written entries since we loaded the file
+        entries = self._read(self._week)
+        entries.update(self._entries)
+        self._entries = entries
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'week': self._week, 'entries': self._entries}, file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def get(self, kind, keyword, window):
+        with self._lock:
+            self._load()
+            return self._entries.get(self._key(kind, keyword, window))
+
+    def set(self, kind, keyword, window, value):
+        with self._lock:
+            self._load()
+            self._entries[self._key(kind, keyword, window)] = value
+            try:
+                self._save()
+            except OSError as e:
+                print('trend cache save error', e)
+
+    def clear(self):
+        with self._lock:
+            self._week = current_week()
+            self._entries = {}
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def get_or_fetch(self, kind, keyword, window, fetch):
+        value = self.get(kind, keyword, window)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = fetch()
+        # empty answers may be temporary, ask again next time
+        if value:
+            self.set(kind, keyword, window, value)
+        return value
+
+
+trend_cache = TrendCache()
@@ -0,0 +1,60 @@
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+from service.term_matrix import TermMatrixBuilder, TermMatrixVectorizer
+
+
+DOCUMENTS = ['배송 빠르다 배송', 'Good 맛 좋다', '포장 별로 배송', 'good good 맛', '가격 저렴 포장']
+
+
+def build(documents, max_features=None, chunk=2):
+    terms = TermMatrixBuilder()
+    for i in range(0, len(documents), chunk):
+        terms.add([document.split() for document in documents[i:i + chunk]])
+    return terms.build(max_features)
+
+
+def test_builder_matches_count_vectorizer():
+    vectorizer = CountVectorizer(tokenizer=str.split, token_pattern=None)
+    expected = vectorizer.fit_transform(DOCUMENTS)
+    X, words = build(DOCUMENTS)
+    assert words.tolist() == vectorizer.get_feature_names_out().tolist()
+    assert X.toarray().tolist() == expected.toarray().tolist()
+    assert X.dtype == np.int64
+
+
+def test_builder_cap_keeps_most_frequent():
+    vectorizer = CountVectorizer(tokenizer=str.split, token_pattern=None, max_features=2)
+    expected = vectorizer.fit_transform(DOCUMENTS)
+    X, words = build(DOCUMENTS, max_features=2)
+    assert words.tolist() == ['good', '배송']
+    assert words.tolist() == vectorizer.get_feature_names_out().tolist()
+    assert X.toarray().tolist() == expected.toarray().tolist()
+    # 맛 and 포장 tie for the third place, the first word wins whatever order the tokens came in
+    assert build(DOCUMENTS, max_features=3)[1].tolist() == ['good', '맛', '배송']
+    assert build(DOCUMENTS[::-1], max_features=3)[1].tolist() == ['good', '맛', '배송']
+
+
+def test_builder_cap_ties_by_word():
+    X, words = build(['다 나 가', '라 마'], max_features=2)
+    assert words.tolist() == ['가', '나']
+    assert X.toarray().tolist() == [[1, 1], [0, 0]]
+
+
+def test_builder_empty():
+    X, words = TermMatrixBuilder().build()
+    assert X.shape == (0, 0)
+    assert len(words) == 0
+
+
+def test_vectorizer():
+    X, words = build(DOCUMENTS)
+    vectorizer = TermMatrixVectorizer(X, words, DOCUMENTS)
+    assert vectorizer.fit(DOCUMENTS) is vectorizer
+    assert (vectorizer.transform(DOCUMENTS[::-1]) != X[::-1]).nnz == 0
+    # texts it wasn't built with are split over the same vocabulary, unknown words are dropped
+    joined = vectorizer.transform([DOCUMENTS[0] + ' ' + DOCUMENTS[2], '배송 새단어', DOCUMENTS[1]])
+    assert joined[0].toarray().tolist() == (X[0] + X[2]).toarray().tolist()
+    assert joined[1].sum() == 1
+    assert joined[2].toarray().tolist() == X[1].toarray().tolist()
+    assert vectorizer.get_feature_names_out().tolist() == words.tolist()
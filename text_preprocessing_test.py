@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('kiwipiepy')
+
+from service.text_preprocessing import PreprocessedBuffer, parse_times, month_index, month_label
+
+
+def test_parse_times_strings():
+    times = parse_times(pd.Series(['2023-01-31T23:59:59.000+09:00', '2023-02-01T00:00:00.500+09:00']))
+    assert pd.api.types.is_datetime64_any_dtype(times)
+    assert times[0] == pd.Timestamp('2023-01-31 23:59:59', tz='Asia/Seoul')
+    assert times[1] == pd.Timestamp('2023-02-01 00:00:00.5', tz='Asia/Seoul')
+
+
+def test_parse_times_datetimes_pass_through():
+    times = pd.Series(pd.to_datetime(['2023-01-01T00:00:00+09:00']))
+    assert parse_times(times) is times
+
+
+def test_parse_times_rejects_other_formats():
+    with pytest.raises(ValueError):
+        parse_times(pd.Series(['2023/01/01 00:00']))
+
+
+def test_month_index():
+    times = parse_times(pd.Series(['2022-12-31T23:00:00.000+09:00', '2023-01-01T00:30:00.000+09:00',
+                                   '2023-12-15T12:00:00.000+09:00']))
+    # months are counted in the reviews' own timezone, not UTC
+    assert month_index(times).tolist() == [2022 * 12 + 11, 2023 * 12, 2023 * 12 + 11]
+    assert str(month_index(times).dtype) == 'int32'
+    assert [month_label(m) for m in month_index(times)] == ['2022. 12.', '2023. 1.', '2023. 12.']
+
+
+def test_preprocessed_buffer():
+    buffer = PreprocessedBuffer()
+    assert len(buffer.to_pandas()) == 0
+    times = parse_times(pd.Series(['2023-01-01T00:00:00.000+09:00', '2023-02-01T00:00:00.000+09:00']))
+    for i in range(2):
+        buffer.append(pd.DataFrame({'document': ['배송 빠르다'], 'time': times[i:i + 1].reset_index(drop=True),
+                                    'month': month_index(times[i:i + 1]).tolist(), 'content': ['배송 빨라요'],
+                                    'star_rating': [5]}))
+    df = buffer.to_pandas()
+    assert len(buffer) == 2
+    assert df['document'].tolist() == ['배송 빠르다', '배송 빠르다']
+    assert df['month'].tolist() == month_index(times).tolist()
+    assert df['time'].tolist() == times.tolist()
+    assert str(df['star_rating'].dtype) == 'int8'
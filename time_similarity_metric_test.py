@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from util.time_similarity_metric import dynamic_time_warping, dtw_many, dtw_top_k, lb_keogh_many, top_k
+
+
+def scalar_dtw(x, y, window=None):
+    # the cell by cell loop dtw_many replaced, with the same Sakoe-Chiba band
+    m, n = len(x), len(y)
+    if window is not None:
+        window = max(window, abs(m - n))
+    dtw = np.full((m + 1, n + 1), np.inf)
+    dtw[0, 0] = 0
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            if window is not None and abs(i - j) > window:
+                continue
+            dtw[i, j] = abs(x[i - 1] - y[j - 1]) + min(dtw[i - 1, j], dtw[i, j - 1], dtw[i - 1, j - 1])
+    return dtw[m, n]
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    return rng.random((40, 24)), rng.random(24)
+
+
+@pytest.mark.parametrize('window', [None, 0, 3])
+def test_dtw_many_matches_scalar(series, window):
+    X, y = series
+    expected = [scalar_dtw(x, y, window) for x in X]
+    assert dtw_many(X, y, window).tolist() == expected
+    assert dynamic_time_warping(X[0], y, window) == expected[0]
+
+
+def test_dtw_many_unequal_lengths(series):
+    X, y = series
+    # the band is widened to the length difference so the last cell stays reachable
+    assert dtw_many(X[:, :18], y, window=2).tolist() == [scalar_dtw(x, y, 2) for x in X[:, :18]]
+
+
+def test_dtw_many_chunks(series, monkeypatch):
+    X, y = series
+    monkeypatch.setattr('util.time_similarity_metric.DTW_CHUNK', 7)
+    assert dtw_many(X, y).tolist() == [scalar_dtw(x, y) for x in X]
+
+
+def test_dtw_many_abandon(series):
+    X, y = series
+    exact = dtw_many(X, y)
+    threshold = np.median(exact)
+    abandoned = dtw_many(X, y, abandon_above=threshold)
+    # rows within the threshold keep their distance, the others are exact or inf
+    kept = exact <= threshold
+    assert abandoned[kept].tolist() == exact[kept].tolist()
+    assert np.all((abandoned[~kept] == exact[~kept]) | np.isinf(abandoned[~kept]))
+
+
+@pytest.mark.parametrize('window', [None, 3])
+def test_lb_keogh_is_lower_bound(series, window):
+    X, y = series
+    assert np.all(lb_keogh_many(X, y, window) <= dtw_many(X, y, window) + 1e-12)
+
+
+@pytest.mark.parametrize('window', [None, 3])
+def test_dtw_top_k_matches_full_sort(series, window):
+    X, y = series
+    exact = np.array([scalar_dtw(x, y, window) for x in X])
+    expected = np.lexsort((np.arange(len(X)), exact))[:5]
+    idx, dist = dtw_top_k(X, y, 5, window, chunk_size=8)
+    assert idx.tolist() == expected.tolist()
+    assert dist.tolist() == exact[expected].tolist()
+
+
+def test_dtw_top_k_ties():
+    y = np.zeros(6)
+    X = np.array([[1.0] * 6, [0.5] * 6, [0.5] * 6, [2.0] * 6])
+    idx, dist = dtw_top_k(X, y, 2, chunk_size=1)
+    assert idx.tolist() == [1, 2]
+    assert dist.tolist() == [3.0, 3.0]
+
+
+def test_top_k():
+    scores = np.array([0.2, np.nan, 0.9, 0.5, 0.9])
+    assert top_k(scores, 3).tolist() == [2, 4, 3]
+    assert top_k(scores, 2, largest=False).tolist() == [0, 3]
+    assert top_k(scores, 10).tolist() == [2, 4, 3, 0, 1]
+    assert top_k(scores, 0).tolist() == []
@@ -0,0 +1,62 @@
+import threading
+
+from service.token_cache import TokenCache, config_digest, normalize_text
+
+
+def test_normalize_text():
+    assert normalize_text('  배송   빠르고\n좋아요 ') == '배송 빠르고 좋아요'
+    # decomposed jamo compose to the same text
+    assert normalize_text('\u1100\u1161') == '\uac00'
+
+
+def test_config_digest():
+    digest = config_digest('0.15', ['NNG', 'VA'], {'것', '수'})
+    assert digest == config_digest('0.15', ['VA', 'NNG'], {'수', '것'})
+    assert digest != config_digest('0.16', ['NNG', 'VA'], {'것', '수'})
+    assert digest != config_digest('0.15', ['NNG'], {'것', '수'})
+
+
+def test_hits_and_misses(tmp_path):
+    cache = TokenCache(str(tmp_path / 'tokens.sqlite'))
+    digest = config_digest('0.15', ['NNG'], set())
+    keys = [cache.key(digest, text) for text in ('배송 빠르고', '맛있어요', '재구매')]
+    assert cache.get_many(keys) == {}
+    assert cache.stats() == {'hits': 0, 'misses': 3, 'hit_rate': 0.0}
+
+    cache.set_many([(keys[0], ['배송']), (keys[1], ['맛'])])
+    # a key asked for twice counts twice
+    assert cache.get_many(keys + keys[:1]) == {keys[0]: ['배송'], keys[1]: ['맛']}
+    assert cache.stats() == {'hits': 3, 'misses': 4, 'hit_rate': round(3 / 7, 4)}
+
+    # another tokenizer setup doesn't see the entries
+    assert cache.get_many([cache.key(config_digest('0.16', ['NNG'], set()), '배송 빠르고')]) == {}
+
+    cache.clear()
+    assert cache.stats()['hits'] == 0
+    assert cache.get_many(keys) == {}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = TokenCache(str(tmp_path / 'tokens.sqlite'), max_entries=10)
+    for i in range(10):
+        cache.set_many([('key{}'.format(i), [str(i)])])
+    cache.get_many(['key0'])
+    # 11 entries, one over the limit plus a tenth of it are dropped: key1 and key2 were used the longest ago
+    cache.set_many([('key10', ['10'])])
+    found = cache.get_many(['key{}'.format(i) for i in range(11)])
+    assert sorted(found) == sorted(['key0'] + ['key{}'.format(i) for i in range(3, 11)])
+
+
+def test_counters_across_threads(tmp_path):
+    cache = TokenCache(str(tmp_path / 'tokens.sqlite'))
+    cache.set_many([('hit', ['a'])])
+
+    def read():
+        for _ in range(50):
+            cache.get_many(['hit', 'miss'])
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats() == {'hits': 200, 'misses': 200, 'hit_rate': 0.5}
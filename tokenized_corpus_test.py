@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('kiwipiepy')
+
+from service.text_preprocessing import parse_times, month_index
+from service.tokenized_corpus import TokenizedCorpus
+
+
+def make_corpus(stars, months, documents=None):
+    times = parse_times(pd.Series(['2023-{:02d}-15T12:00:00.000+09:00'.format(m) for m in months]))
+    documents = documents or ['배송 빠르다 {}'.format(i) for i in range(len(stars))]
+    data = pd.DataFrame({'document': documents, 'time': times, 'month': month_index(times),
+                         'content': ['리뷰 {}'.format(i) for i in range(len(stars))], 'star_rating': stars})
+    return TokenizedCorpus(data, ['리뷰 0'])
+
+
+def test_terms():
+    corpus = make_corpus([5, 5, 1], [1, 2, 3], ['배송 빠르다', '맛 좋다 좋다', '배송 느리다'])
+    assert corpus.words.tolist() == ['느리다', '맛', '배송', '빠르다', '좋다']
+    assert corpus.terms.toarray().tolist() == [[0, 0, 1, 1, 0], [0, 1, 0, 0, 2], [1, 0, 1, 0, 0]]
+
+
+def test_view():
+    corpus = make_corpus([5, 1, 4, 5, 3], [1, 1, 2, 3, 3], ['배송 빠르다', '배송 느리다', '맛 좋다', '맛 빠르다', '포장 별로'])
+    corpus.embeddings = np.arange(10, dtype=np.float32).reshape(5, 2)
+    assert corpus.view() is corpus
+
+    pros = corpus.view([4, 5])
+    assert pros.documents == ['배송 빠르다', '맛 좋다', '맛 빠르다']
+    assert pros.embeddings.tolist() == corpus.embeddings[[0, 2, 3]].tolist()
+    assert pros.head == corpus.head
+    # words no review of the view uses are dropped
+    assert pros.words.tolist() == ['맛', '배송', '빠르다', '좋다']
+    assert pros.terms.toarray().tolist() == [[0, 1, 1, 0], [1, 0, 0, 1], [1, 0, 1, 0]]
+    assert {star: rows.tolist() for star, rows in pros.star_index.items()} == {4: [1], 5: [0, 2]}
+    assert pros.months == ['2023. 1.', '2023. 2.', '2023. 3.']
+
+    empty = corpus.view([2, 2])
+    assert len(empty) == 0
+    assert empty.terms.shape == (0, 0)
+
+
+def test_sample_rows():
+    rng = np.random.default_rng(0)
+    stars = [5] * 900 + [1] * 90 + [3] * 10
+    months = rng.integers(1, 13, len(stars)).tolist()
+    corpus = make_corpus(stars, months)
+    rows = corpus.sample_rows(100)
+    # small strata get one row even if their share is less, the sample can run over by a few
+    strata = corpus.data.groupby(['star_rating', 'month']).ngroups
+    assert 100 <= len(rows) <= 100 + strata // 2
+    assert rows.tolist() == sorted(set(rows.tolist()))
+    sample = corpus.data.iloc[rows]
+    # every (star rating, month) stratum is in the sample, in proportion to its size
+    assert set(zip(sample['star_rating'], sample['month'])) == set(zip(corpus.data['star_rating'], corpus.data['month']))
+    assert 85 <= (sample['star_rating'] == 5).sum() <= 90
+    assert corpus.sample_rows(100).tolist() == rows.tolist()
+    assert corpus.sample_rows(100, seed=1).tolist() != rows.tolist()
+    assert corpus.sample_rows(len(corpus)).tolist() == list(range(len(corpus)))
+
+
+def test_sample_rows_small_strata():
+    # more strata than the sample size, every stratum still gets a row
+    corpus = make_corpus([1, 2, 3, 4, 5] * 3, [1] * 5 + [2] * 5 + [3] * 5)
+    rows = corpus.sample_rows(4)
+    assert len(rows) == 15
+    assert corpus.sample_rows(20).tolist() == list(range(15))
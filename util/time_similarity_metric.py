@@ -20,18 +20,120 @@ def distance(a, b):
     return abs(a - b)
 
 
-def dynamic_time_warping(x, y):
-    m = len(x)
+def dynamic_time_warping(x, y, window=None):
+    return dtw_many(np.asarray(x, dtype=float)[None, :], y, window)[0]
+
+
+# rows of X computed together, the cost matrix takes rows * (len(x)+1) * (len(y)+1) floats
+DTW_CHUNK = 512
+
+
+def dtw_many(X, y, window=None, abandon_above=None):
+    """dynamic_time_warping of every row of X (series x time) with y.
+
+    Cells are filled one anti-diagonal at a time for all rows at once, each cell sums the same terms
+    as the cell by cell loop so distances are identical. ``window`` is a Sakoe-Chiba band: only cells
+    with |i - j| <= window are used (widened to the length difference so the end stays reachable).
+    Rows whose distance is certain to exceed ``abandon_above`` may be dropped early, they get inf.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    y = np.asarray(y, dtype=float)
+    if len(X) > DTW_CHUNK:
+        return np.concatenate([dtw_many(X[i:i + DTW_CHUNK], y, window, abandon_above)
+                               for i in range(0, len(X), DTW_CHUNK)])
+    b, m = X.shape
     n = len(y)
+    if window is not None:
+        window = max(window, abs(m - n))
+
+    result = np.full(b, np.inf)
+    active = np.arange(b)
+    dtw = np.full((b, m + 1, n + 1), np.inf)
+    dtw[:, 0, 0] = 0
+    previous_min = np.zeros(b)
+    for d in range(2, m + n + 1):
+        i = np.arange(max(1, d - n), min(m, d - 1) + 1)
+        j = d - i
+        if window is not None:
+            band = np.abs(i - j) <= window
+            i, j = i[band], j[band]
+        if len(i) == 0:
+            continue
+        cost = np.abs(X[:, i - 1] - y[j - 1])
+        dtw[:, i, j] = cost + np.minimum(np.minimum(dtw[:, i - 1, j], dtw[:, i, j - 1]), dtw[:, i - 1, j - 1])
+
+        if abandon_above is not None:
+            # every path crosses anti-diagonal d or d - 1 and costs are never negative
+            current_min = dtw[:, i, j].min(axis=1)
+            alive = np.minimum(current_min, previous_min) <= abandon_above
+            previous_min = current_min
+            # dropping rows copies the cost matrix, only worth it for a good share of them
+            if (~alive).sum() * 4 >= len(alive):
+                active, dtw, X, previous_min = active[alive], dtw[alive], X[alive], previous_min[alive]
+                if len(active) == 0:
+                    return result
+
+    result[active] = dtw[:, m, n]
+    return result
+
+
+def lb_keogh_many(X, y, window=None):
+    """LB_Keogh lower bound of dtw_many(X, y, window) for every row of X."""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    y = np.asarray(y, dtype=float)
+    m, n = X.shape[1], len(y)
+    w = max(m, n) if window is None else max(window, abs(m - n))
+    upper = np.array([y[max(0, i - w):i + w + 1].max() for i in range(m)])
+    lower = np.array([y[max(0, i - w):i + w + 1].min() for i in range(m)])
+    return (np.maximum(X - upper, 0) + np.maximum(lower - X, 0)).sum(axis=1)
+
+
+def dtw_top_k(X, y, k, window=None, chunk_size=256):
+    """Indices and distances of the k rows of X closest to y by DTW, closest first.
+
+    Rows are visited in LB_Keogh order, the search stops once the bound passes the k-th best
+    distance and the rows computed meanwhile are abandoned as soon as they pass it.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    # a bound summed in another order may be an ulp above the exact distance, don't prune ties
+    bounds = lb_keogh_many(X, y, window) * (1 - 1e-9)
+    order = np.argsort(bounds, kind='stable')
+    best_idx = np.array([], dtype=np.int64)
+    best_dist = np.array([])
+    for start in range(0, len(order), chunk_size):
+        threshold = best_dist[k - 1] if len(best_dist) >= k else None
+        candidates = order[start:start + chunk_size]
+        if threshold is not None:
+            candidates = candidates[bounds[candidates] <= threshold]
+            if len(candidates) == 0:
+                break
+        dist = dtw_many(X[candidates], y, window, abandon_above=threshold)
+        best_idx = np.concatenate([best_idx, candidates])
+        best_dist = np.concatenate([best_dist, dist])
+        keep = np.lexsort((best_idx, best_dist))[:k]
+        best_idx, best_dist = best_idx[keep], best_dist[keep]
+    return best_idx, best_dist
+
+
+def pearson_corr_many(X, y):
+    """pearson_corr of every row of X (series x time) with y."""
+    Xc = X - X.mean(axis=1, keepdims=True)
+    yc = y - np.mean(y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (Xc @ yc) / (np.linalg.norm(Xc, axis=1) * np.linalg.norm(yc))
 
-    dtw = np.zeros((m+1, n+1))
-    dtw[0, 1:] = np.inf
 
-    dtw[1:, 0] = np.inf
+def mse_many(X, y):
+    """mse of every row of X (series x time) with y."""
+    return ((X - y) ** 2).mean(axis=1)
 
-    for i in range(1, m+1):
-        for j in range(1, n+1):
-            cost = distance(x[i-1], y[j-1])
-            dtw[i, j] = cost + min(dtw[i-1, j], dtw[i, j-1], dtw[i-1, j-1])
 
-    return dtw[m, n]
\ No newline at end of file
+def top_k(scores, k, largest=True):
+    """Indices of the k best scores, best first, nan scores rank last."""
+    keys = -scores if largest else scores
+    keys = np.where(np.isnan(keys), np.inf, keys)
+    k = min(k, len(keys))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    part = np.argpartition(keys, k - 1)[:k]
+    return part[np.lexsort((part, keys[part]))]